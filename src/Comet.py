@@ -1,17 +1,19 @@
-from panda3d.core import (NodePath, GeomNode, Geom, GeomVertexFormat, GeomVertexData, GeomPoints, AmbientLight,
-                            GeomVertexWriter, GeomTriangles, Vec4, Material, Plane, PlaneNode,
+from panda3d.core import (NodePath, GeomNode, Geom, GeomVertexData, GeomPoints, AmbientLight,
+                            GeomTriangles, Vec4, Material, Plane, PlaneNode,
                             RenderModeAttrib, TransparencyAttrib, ColorBlendAttrib, PointLight, Material)
-from panda3d.core import NodePath, Material, GeomNode, Geom, GeomVertexFormat, GeomVertexData, GeomVertexWriter, GeomTriangles, CardMaker, TransparencyAttrib
-import random
+from panda3d.core import NodePath, Material, GeomNode, Geom, GeomVertexData, GeomTriangles, CardMaker, TransparencyAttrib
+import math
 from direct.showbase.ShowBase import ShowBase
 from direct.task import Task
 import numpy as np
 from collections import deque
+from mesh import fill_vertex_data, vertex_format
 
 
 class Comet:
 
-    def __init__(self, radius=10, pos=(0,0,0), velocity=(0.1,0,0)):
+    def __init__(self, radius=10, pos=(0,0,0), velocity=(0.1,0,0), seed=None):
+        self.rng = np.random.default_rng(seed)
         self.radius = radius
         self.position = pos
         self.velocity = velocity
@@ -21,6 +23,8 @@ class Comet:
         self.comet_light = PointLight('comet_light')
         self.comet_light.setColor(Vec4(0.5, 0.5, 1, 1))
         self.comet_light_node = self.node.attachNewNode(self.comet_light)
+        self.light_node = self.comet_light_node
+        self.managed_light = False
         render.setLight(self.comet_light_node)
         
         self.comet_light.setAttenuation((1, 0, 0.01))
@@ -29,30 +33,55 @@ class Comet:
         self.trail_node.reparentTo(self.node)
         self.node.setPos(*self.position)
 
-        self.create_comet()
+        self.core_node = self.create_comet()
 
-        self.trail_particles = []
+        self.create_trail()
+
+
+    def reset(self, radius=10, pos=(0,0,0), velocity=(0.1,0,0), seed=None):
+        """
+        Reuses this comet with new parameters (see ObjectPool). The core points
+        are rewritten in place and the light is turned back on.
+        """
+        self.rng = np.random.default_rng(seed)
+        self.radius = radius
+        self.position = pos
+        self.velocity = velocity
+
+        fill_vertex_data(self.core_node.node().modifyGeom(0).modifyVertexData(), self.core_columns())
+
+        if not self.managed_light:
+            render.setLight(self.comet_light_node)
+        self.node.reparentTo(render)
+        self.node.setPos(*self.position)
+        self.clear_trail()
+
+
+    @staticmethod
+    def extent(radius=10, **params):
+        # the core points are anywhere in a cube of +-radius, the trail isn't counted
+        return radius * math.sqrt(3)
+
+
+    def release_light(self):
+        # A LightManager decides where the light is enabled from now on
+        render.clearLight(self.comet_light_node)
+        self.managed_light = True
+
+
+    def detach(self):
+        render.clearLight(self.comet_light_node)
+        self.clear_trail()
+        self.node.detachNode()
 
     
     def create_comet(self):
-        format = GeomVertexFormat.getV3n3c4()
-        vdata = GeomVertexData("comet", format, Geom.UHDynamic)
-        vertex = GeomVertexWriter(vdata, "vertex")
-        normal = GeomVertexWriter(vdata, "normal")
-        color = GeomVertexWriter(vdata, "color")
-
-        # Making sphere for the comet's 'core'
-        for i in range(10):
-            x = self.radius * random.uniform(-1, 1)
-            y = self.radius * random.uniform(-1, 1)
-            z = self.radius * random.uniform(-1, 1)
-
-            vertex.addData3f(x, y, z)
-            normal.addData3f(x, y, z)
-            color.addData4f(0.5, 0.5, 1, 1)  # light blue
+        format = vertex_format('point')
+        vdata = GeomVertexData("comet", format, Geom.UHStatic)
+        fill_vertex_data(vdata, self.core_columns())
 
         # Making the trail
-        points = GeomPoints(Geom.UHDynamic)
+        points = GeomPoints(Geom.UHStatic)
         points.addNextVertices(10)
         points.closePrimitive()
 
@@ -64,39 +93,72 @@ class Comet:
         comet_material = Material()
         comet_material.setShininess(100)
         comet_material.setEmission(Vec4(0.5, 0.5, 1, 1))  # light blue glow
-        comet_node = NodePath(node)
-        comet_node.setPos(*self.position)
+        # the core moves with the comet node, so it sits at its origin
+        comet_node = self.node.attachNewNode(node)
         comet_node.setMaterial(comet_material, 1)
 
         return comet_node
     
 
-    def create_trail_particle(self):
-        # Geometry for the comet's trail particle -- doesnt look great but its fine lmao
-        format = GeomVertexFormat.getV3n3c4()
-        vdata = GeomVertexData("trail_particle", format, Geom.UHDynamic)
-        vertex = GeomVertexWriter(vdata, "vertex")
-        color = GeomVertexWriter(vdata, "color")
+    def core_columns(self):
+        # Making sphere for the comet's 'core' -- 10 random points around the center
+        vertices = self.radius * self.rng.uniform(-1, 1, (10, 3))
+        return {
+            'vertex': vertices,
+            'color': np.broadcast_to(np.array([0.5, 0.5, 1, 1]), (10, 4)),  # light blue
+        }
 
-        vertex.addData3f(0, 0, 0)
-        color.addData4f(0.5, 0.5, 1, 1)  # Light blue color
 
-        points = GeomPoints(Geom.UHDynamic)
-        points.addNextVertices(1)
+    def create_trail(self, decay=0.01, color=(0.5, 0.5, 1, 1)):
+        """
+        The trail is one point Geom used as a ring buffer: each frame overwrites the
+        oldest point with the current position, and a point lives 1/decay frames.
+        """
+        self.trail_decay = decay
+        self.trail_capacity = int(round(1.0 / decay))
+        self.trail_positions = np.zeros((self.trail_capacity, 3), dtype=np.float32)  # world space
+        self.trail_colors = np.tile(np.array(color, dtype=np.float32), (self.trail_capacity, 1))
+        self.trail_ages = np.arange(self.trail_capacity)
+        self.trail_head = 0
+        self.trail_count = 0
+
+        format = vertex_format('trail')
+        vdata = GeomVertexData("trail", format, Geom.UHDynamic)
+        vdata.setNumRows(self.trail_capacity)
+
+        points = GeomPoints(Geom.UHStatic)
+        points.addNextVertices(self.trail_capacity)
         points.closePrimitive()
 
         geom = Geom(vdata)
         geom.addPrimitive(points)
-        node = GeomNode("trail_particle")
+        node = GeomNode("trail")
         node.addGeom(geom)
 
-        trail_particle_node = self.trail_node.attachNewNode(node)
-        trail_particle_node.setPos(*self.position)
-        trail_particle_node.setBin("fixed", 0)
-        trail_particle_node.setDepthWrite(False)
-        trail_particle_node.setRenderMode(RenderModeAttrib.MPoint, 5)
-
-        return trail_particle_node
+        self.trail_geom_node = self.trail_node.attachNewNode(node)
+        self.trail_geom_node.setBin("fixed", 0)
+        self.trail_geom_node.setDepthWrite(False)
+        self.trail_geom_node.setTransparency(TransparencyAttrib.MAlpha)
+        self.trail_geom_node.setRenderMode(RenderModeAttrib.MPoint, 5)
+        self.write_trail()
+
+    def clear_trail(self):
+        self.trail_count = 0
+        self.write_trail()
+
+    def write_trail(self):
+        # Ages in frames of every slot, newest is 0. Slots not written yet are fully transparent
+        ages = (self.trail_head - self.trail_ages) % self.trail_capacity
+        alpha = 1.0 - (ages + 1) * self.trail_decay
+        alpha[ages >= self.trail_count] = 0
+        self.trail_colors[:, 3] = alpha
+
+        # trail_node moves with the comet, so the points are stored relative to it
+        vdata = self.trail_geom_node.node().modifyGeom(0).modifyVertexData()
+        fill_vertex_data(vdata, {
+            'vertex': self.trail_positions - np.asarray(self.position, dtype=np.float32),
+            'color': self.trail_colors,
+        })
 
     def update(self, task):
         dt = globalClock.getDt()
@@ -109,25 +171,18 @@ class Comet:
         
 
     def update_trail(self):
-        for particle in self.trail_particles:
-            if particle['life'] <= 0:
-                particle['node'].removeNode()
-
-        self.trail_particles = [particle for particle in self.trail_particles if particle['life'] > 0]
+        self.trail_head = (self.trail_head + 1) % self.trail_capacity
+        self.trail_positions[self.trail_head] = self.position
+        self.trail_count = min(self.trail_count + 1, self.trail_capacity)
+        self.write_trail()
 
-        new_particle_node = self.create_trail_particle()
-        new_particle = {
-            'node': new_particle_node,
-            'life': 1.0,  # full life span
-            'decay': 0.01  # how quickly the particle fades
-        }
-        self.trail_particles.append(new_particle)
+    
+    def destroy(self):
+        # the light was set on render, so it has to be cleared there too
+        render.clearLight(self.comet_light_node)
+        self.node.removeNode()
 
-        for particle in self.trail_particles:
-            particle['life'] -= particle['decay']
-            particle['node'].setSa(particle['life'])
 
-    
     def set_position(self, pos):
         self.position = pos
         self.node.setPos(*self.position)
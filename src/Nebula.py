@@ -1,16 +1,104 @@
-from panda3d.core import (NodePath, GeomNode, Geom, GeomVertexFormat, GeomVertexData,
-                          GeomVertexWriter, GeomLines, Vec4, Material, AmbientLight,
+from panda3d.core import (NodePath, GeomNode, Geom, GeomVertexData, GeomLines, Vec4, Material, AmbientLight,
                           RenderModeAttrib, TransparencyAttrib, ColorBlendAttrib, GeomPoints,
-                          )
+                          BoundingSphere, LVecBase4f, LVecBase4i, Shader, ShaderAttrib)
 from direct.showbase.ShowBase import ShowBase
 from direct.filter.CommonFilters import CommonFilters
-import random
 import numpy as np
+from mesh import fill_vertex_data, pack_colors, vertex_format
+
+
+# Start and end colors of the gradient along each arm
+NEBULA_START_COLOR = np.array([0.5, 0.0, 0.5, 1.0])  # Purple
+NEBULA_END_COLOR = np.array([0.0, 0.0, 1.0, 1.0])    # Blue
+
+# Shared by every nebula, so nebulae with the same point size can be batched together
+NEBULA_MATERIAL = Material()
+NEBULA_MATERIAL.setEmission(Vec4(0.2, 0.2, 0.8, 1))  # blue-ish glow
+
+# GPU path (gpu=True): only the arm spine points are uploaded, and every spine point
+# is drawn num_particles times with instancing. The shader jitters each copy with a
+# hash of the seed, spine point and instance, so nothing random is stored per particle.
+NEBULA_VERTEX_SHADER = """
+#version 150
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform vec4 p3d_ColorScale;
+uniform vec4 nebula;       // thickness, thickness * depth, points_per_arm, point_size
+uniform ivec4 nebula_seed;
+uniform vec4 start_color;
+uniform vec4 end_color;
+
+in vec4 p3d_Vertex;
+out vec4 color;
+
+uint hash(uint x) {
+    x ^= x >> 16u;
+    x *= 0x7feb352du;
+    x ^= x >> 15u;
+    x *= 0x846ca68bu;
+    x ^= x >> 16u;
+    return x;
+}
+
+// uniform in [-1, 1)
+float jitter(uint key) {
+    return float(hash(key) >> 8u) / 8388608.0 - 1.0;
+}
+
+void main() {
+    uint particle = hash(uint(nebula_seed.x) ^ hash(uint(gl_VertexID) * 65599u + uint(gl_InstanceID)));
+    vec4 pos = p3d_Vertex;
+    pos.x += nebula.x * jitter(particle * 3u);
+    pos.y += nebula.x * jitter(particle * 3u + 1u);
+    pos.z += nebula.y * jitter(particle * 3u + 2u);
+    gl_Position = p3d_ModelViewProjectionMatrix * pos;
+    gl_PointSize = nebula.w;
+
+    float factor = float(gl_VertexID % int(nebula.z)) / max(nebula.z - 1.0, 1.0);
+    color = mix(start_color, end_color, factor) * p3d_ColorScale;
+}
+"""
+
+NEBULA_FRAGMENT_SHADER = """
+#version 150
+
+in vec4 color;
+out vec4 p3d_FragColor;
+
+void main() {
+    p3d_FragColor = color;
+}
+"""
+
+_nebula_shader = None
+
+
+def gpu_nebula_supported():
+    """
+    Whether the current window can run the GPU path: GLSL 1.50 and instancing.
+    Without a window (window-type none) the CPU path is used.
+    """
+    win = getattr(base, 'win', None)
+    gsg = win.getGsg() if win is not None else None
+    if gsg is None or not gsg.getSupportsGlsl() or not gsg.getSupportsGeometryInstancing():
+        return False
+    return (gsg.getDriverShaderVersionMajor(), gsg.getDriverShaderVersionMinor()) >= (1, 50)
+
+
+def nebula_shader():
+    global _nebula_shader
+    if _nebula_shader is None:
+        _nebula_shader = Shader.make(Shader.SL_GLSL, NEBULA_VERTEX_SHADER, NEBULA_FRAGMENT_SHADER)
+    return _nebula_shader
+
 
 class Nebula:
 
     def __init__(self, scale=1.0, pos=(0, 0, 0), num_arms=2, points_per_arm=100, thickness=0.1,
-                  num_particles=10, point_size=8, depth=5.0):
+                  num_particles=10, point_size=8, depth=5.0, points=None, incremental=False, fade_in=True,
+                  seed=None, gpu=False):
+        self.seed = seed
+        self.gpu = gpu and gpu_nebula_supported()
         self.scale = scale
         self.position = pos
         self.num_arms = num_arms
@@ -19,49 +107,186 @@ class Nebula:
         self.num_particles = num_particles
         self.point_size = point_size
         self.depth = depth
+        self.fade_in = fade_in
         self.node = self.create_nebula()
+        self.load_points(points, incremental)
 
         self.node.setP(-90) # pitch rotation to make the nebula face the camera
 
+
+    def reset(self, scale=1.0, pos=(0, 0, 0), num_arms=2, points_per_arm=100, thickness=0.1,
+              num_particles=10, point_size=8, depth=5.0, points=None, incremental=False, fade_in=True,
+              seed=None, gpu=False):
+        """
+        Reuses this nebula with new parameters (see ObjectPool). The point cloud
+        is rewritten into the existing vertex data instead of a new one.
+        """
+        self.seed = seed
+        self.gpu = gpu and gpu_nebula_supported()
+        self.scale = scale
+        self.position = pos
+        self.num_arms = num_arms
+        self.points_per_arm = points_per_arm
+        self.thickness = thickness
+        self.num_particles = num_particles
+        self.point_size = point_size
+        self.depth = depth
+        self.fade_in = fade_in
+        self.load_points(points, incremental)
+
+        self.node.setPos(*self.position)
+        self.node.setRenderMode(RenderModeAttrib.MPoint, self.point_size)
+
+
+    def detach(self):
+        self.node.detachNode()
+
+
+    def destroy(self):
+        self.node.removeNode()
+
+    @staticmethod
+    def prebuild(scale=1.0, pos=(0, 0, 0), num_arms=2, points_per_arm=100, thickness=0.1,
+                 num_particles=10, point_size=8, depth=5.0, incremental=False, fade_in=True, seed=None,
+                 gpu=False):
+        """
+        Builds the point cloud Nebula(**params) would, without touching panda, so
+        it can run on a worker thread. Returns the extra params (points=) to pass
+        back into Nebula() or reset(). The GPU path has nothing worth prebuilding.
+        """
+        if gpu:
+            return {}
+        return {'points': generate_nebula_points(scale, num_arms, points_per_arm, thickness,
+                                                 num_particles, depth, seed)}
+
+
+    @staticmethod
+    def extent(scale=1.0, num_arms=2, thickness=0.1, depth=5.0, **params):
+        # The last arm ends at theta = 2pi + 2pi * (num_arms - 1) / num_arms, see generate_nebula_points
+        max_theta = 2 * np.pi * (2 * num_arms - 1) / num_arms
+        return float(np.hypot(scale * max_theta + thickness, thickness * depth))
+
+
+    def load_points(self, points=None, incremental=False):
+        """
+        Puts a point cloud in the nebula. points are precomputed generate_points()
+        columns (see prebuild()), generated here if left out.
+        With incremental the cloud starts out empty and is only copied into the
+        vertex data by build_step(), a chunk at a time across several frames.
+        """
+        if self.gpu:
+            self.load_spine()
+            return
+        # back from the GPU path: no shader, instance count or fixed bounds
+        self.node.clearAttrib(ShaderAttrib)
+        self.node.node().clearBounds()
+
+        if points is None:
+            points = self.generate_points()
+        num_points = len(points['vertex'])
+
+        geom = self.node.node().modifyGeom(0)
+        vdata = geom.modifyVertexData()
+        prim = geom.modifyPrimitive(0)
+        prim.clearVertices()
+        vdata.setNumRows(0)
+        vdata.setFormat(vertex_format('cloud'))
+
+        if incremental:
+            self.pending_points = points
+            self.num_built = 0
+            vdata.setNumRows(0)
+            vdata.reserveNumRows(num_points)
+            if self.fade_in:
+                # Drawn additively (ONE, ONE), so alpha does nothing; dimming the color fades it
+                self.node.setColorScale(0, 0, 0, 1)
+        else:
+            self.pending_points = None
+            self.num_built = num_points
+            fill_vertex_data(vdata, points)
+            prim.setNonindexedVertices(0, num_points)
+            self.node.clearColorScale()
+
+
+    def load_spine(self):
+        """
+        GPU path: uploads the num_arms * points_per_arm spine points and lets the
+        shader expand every one into num_particles jittered particles.
+        """
+        self.pending_points = None
+        spine = generate_nebula_spine(self.scale, self.num_arms, self.points_per_arm)
+
+        geom = self.node.node().modifyGeom(0)
+        vdata = geom.modifyVertexData()
+        prim = geom.modifyPrimitive(0)
+        prim.clearVertices()
+        vdata.setNumRows(0)
+        vdata.setFormat(vertex_format('spine'))
+        fill_vertex_data(vdata, {'vertex': spine})
+        prim.setNonindexedVertices(0, len(spine))
+
+        self.node.setShader(nebula_shader())
+        self.node.setShaderInput('nebula', LVecBase4f(self.thickness, self.thickness * self.depth,
+                                                      self.points_per_arm, self.point_size))
+        seed = int(np.random.default_rng(self.seed).integers(2 ** 31))
+        self.node.setShaderInput('nebula_seed', LVecBase4i(seed, 0, 0, 0))
+        self.node.setShaderInput('start_color', LVecBase4f(*NEBULA_START_COLOR))
+        self.node.setShaderInput('end_color', LVecBase4f(*NEBULA_END_COLOR))
+        self.node.setInstanceCount(self.num_particles)
+        self.node.clearColorScale()
+
+        # panda only sees the spine, the particles spread out around it
+        extent = Nebula.extent(self.scale, self.num_arms, self.thickness, self.depth)
+        self.node.node().setBounds(BoundingSphere((0, 0, 0), extent))
+
+
+    def build_step(self, max_points):
+        """
+        Adds up to max_points more points to an incremental nebula, fading it in as
+        it fills up. Returns the number of points added.
+        """
+        if self.pending_points is None:
+            return 0
+        start = self.num_built
+        num_points = len(self.pending_points['vertex'])
+        end = min(start + max_points, num_points)
+
+        geom = self.node.node().modifyGeom(0)
+        chunk = {name: column[start:end] for name, column in self.pending_points.items()}
+        fill_vertex_data(geom.modifyVertexData(), chunk, start)
+        # Always the first `end` rows, set outright. Appending to the cleared primitive
+        # would sometimes turn it indexed, and drawing that could hit a null index array
+        geom.modifyPrimitive(0).setNonindexedVertices(0, end)
+        self.num_built = end
+
+        if end == num_points:
+            self.pending_points = None
+            self.node.clearColorScale()
+        elif self.fade_in:
+            fade = end / num_points
+            self.node.setColorScale(fade, fade, fade, 1)
+        return end - start
+
+
+    def is_built(self):
+        return self.pending_points is None
+
+
+    def static_geometry(self):
+        # The cloud never changes once built, see StaticBatcher. GPU nebulae are
+        # already a handful of vertices and their shader inputs can't be merged
+        if self.gpu:
+            return []
+        return [self.node]
+
+
     def create_nebula(self):
-        format = GeomVertexFormat.getV3n3cpt2()
+        # Starts out empty, load_points() fills it in
+        format = vertex_format('cloud')
         vdata = GeomVertexData('nebula', format, Geom.UHDynamic)
-        
-        vertex = GeomVertexWriter(vdata, 'vertex')
-        normal = GeomVertexWriter(vdata, 'normal')
-        color_writer = GeomVertexWriter(vdata, 'color')  # Renamed to avoid conflict
-        texcoord = GeomVertexWriter(vdata, 'texcoord')
-
-        # Generate points for the spiral arms and the surrounding particles --
-        # uses the formula r = scale * theta, where theta is the angle around the arm
-        for arm in range(self.num_arms):
-            angle_offset = 2 * np.pi * arm / self.num_arms
-            for i in range(self.points_per_arm):
-                theta = i / (self.points_per_arm - 1) * 2 * np.pi + angle_offset
-                r = self.scale * theta
-                x = r * np.cos(theta)
-                y = r * np.sin(theta)
-                z = 0 
-
-                # Create points around the arm points to simulate the nebula cloud
-                for p in range(self.num_particles):  # per point on each arm
-
-                    # Randomize the position around the arm point to give a cloud-like appearance
-                    px = x + random.uniform(-self.thickness, self.thickness)
-                    py = y + random.uniform(-self.thickness, self.thickness)
-                    pz = z + random.uniform(-self.thickness * self.depth, self.thickness * self.depth)
-                    vertex.addData3f(px, py, pz)
-                    normal.addData3f(0, 0, 1)
-
-                    factor = i / (self.points_per_arm - 1)
-                    neb_color = self.generate_random_nebula_color(factor)
-                    color_writer.addData4f(neb_color[0], neb_color[1], neb_color[2], 1.0)  # Full opacity for now
-                    texcoord.addData2f(factor, arm / self.num_arms)
 
         # Use GeomPoints for rendering the nebula
         points = GeomPoints(Geom.UHDynamic)
-        points.addNextVertices(self.num_arms * self.points_per_arm * self.num_particles)
-        points.closePrimitive()
         geom = Geom(vdata)
         geom.addPrimitive(points)
 
@@ -71,9 +296,7 @@ class Nebula:
         nebula_node.setPos(*self.position)
 
         # Material and render attributes -- matte
-        nebula_material = Material()
-        nebula_material.setEmission(Vec4(0.2, 0.2, 0.8, 1))  # blue-ish glow
-        nebula_node.setMaterial(nebula_material)
+        nebula_node.setMaterial(NEBULA_MATERIAL)
         
         # Set render mode for points and enable additive blending
         nebula_node.setRenderMode(RenderModeAttrib.MPoint, self.point_size)  # Point size
@@ -84,16 +307,71 @@ class Nebula:
         return nebula_node
 
 
+    def generate_points(self):
+        return generate_nebula_points(self.scale, self.num_arms, self.points_per_arm, self.thickness,
+                                      self.num_particles, self.depth, self.seed)
+
+
     def generate_random_nebula_color(self, factor):
-        """
-        Generate a color gradient for the nebula based on the factor (ranging from 0 to 1).
-        """
-        # Define the start and end colors for the gradient
-        start_color = np.array([0.5, 0.0, 0.5, 1.0])  # Purple
-        end_color = np.array([0.0, 0.0, 1.0, 1.0])    # Blue
+        return generate_nebula_color(factor)
+
+
+def generate_nebula_spine(scale, num_arms, points_per_arm):
+    """
+    The points along the arms without any jitter, arm after arm, for the GPU path.
+    """
+    factor = (np.arange(points_per_arm) / (points_per_arm - 1))[None, :]
+    arm = np.arange(num_arms)[:, None]
+    theta = factor * 2 * np.pi + 2 * np.pi * arm / num_arms
+    r = scale * theta
+
+    spine = np.zeros((num_arms, points_per_arm, 3), dtype=np.float32)
+    spine[..., 0] = r * np.cos(theta)
+    spine[..., 1] = r * np.sin(theta)
+    return spine.reshape(num_arms * points_per_arm, 3)
+
+
+def generate_nebula_points(scale, num_arms, points_per_arm, thickness, num_particles, depth, seed=None):
+    """
+    Builds every cloud particle at once as numpy columns for fill_vertex_data().
+    Arms lie along r = scale * theta, and each arm point gets num_particles
+    jittered copies around it to give the cloud-like look. The jitter comes
+    from seed (an int or numpy Generator), so the same seed gives the same cloud.
+    Only uses numpy, so it is safe to call off the main thread.
+    """
+    rng = np.random.default_rng(seed)
+    num_points = num_arms * points_per_arm * num_particles
+
+    # factor runs 0..1 along each arm, shape (1, points_per_arm, 1) so it broadcasts over arms and particles
+    factor = (np.arange(points_per_arm) / (points_per_arm - 1))[None, :, None]
+    arm = np.arange(num_arms)[:, None, None]
+    theta = factor * 2 * np.pi + 2 * np.pi * arm / num_arms
+    r = scale * theta
+
+    shape = (num_arms, points_per_arm, num_particles)
+    vertices = np.empty(shape + (3,), dtype=np.float32)
+    vertices[..., 0] = r * np.cos(theta) + rng.uniform(-thickness, thickness, shape)
+    vertices[..., 1] = r * np.sin(theta) + rng.uniform(-thickness, thickness, shape)
+    vertices[..., 2] = rng.uniform(-thickness * depth, thickness * depth, shape)
+
+    # The gradient only depends on the position along the arm, so pack it once per arm point
+    colors = pack_colors(generate_nebula_color(factor.reshape(-1)))
+    colors = np.broadcast_to(colors[None, :, None], shape)
+
+    return {
+        'vertex': vertices.reshape(num_points, 3),
+        'color': colors.reshape(num_points),
+    }
+
 
-        color = (1 - factor) * start_color + factor * end_color
-        return tuple(color)
+def generate_nebula_color(factor):
+    """
+    Generate a color gradient for the nebula based on the factor (ranging from 0 to 1).
+    Works on a single factor or a whole array of them (one color row each).
+    """
+    factor = np.asarray(factor)[..., None]
+    color = (1 - factor) * NEBULA_START_COLOR + factor * NEBULA_END_COLOR
+    return color
 
 
 
@@ -1,145 +1,164 @@
-import random
-from panda3d.core import NodePath, Material, GeomNode, Geom, GeomVertexFormat, GeomVertexData, GeomVertexWriter, GeomTriangles, CardMaker, TransparencyAttrib
+from panda3d.core import NodePath, Material, GeomNode, Geom, GeomVertexData, CardMaker, TransparencyAttrib
 from direct.showbase.ShowBase import ShowBase
-import math
+from mesh import fill_vertex_data, make_sphere_lod, make_triangles, set_sphere_lod_radius, vertex_format
 import numpy as np
 
 
 # https://discourse.panda3d.org/t/procedurally-generating-3d-models/14623/4
 class Planet:
 
-    def __init__(self, radius=1.0, pos=(0, 0, 0), has_rings=False, ring_color=(1, 1, 1, 0.5)):
+    def __init__(self, radius=1.0, pos=(0, 0, 0), has_rings=False, ring_color=(1, 1, 1, 0.5), base_color=None,
+                 seed=None):
+        self.rng = np.random.default_rng(seed)
         self.radius = radius
         self.position = pos
         self.has_rings = has_rings
         self.ring_color = ring_color
         self.node = NodePath("planet_node")
-        self.base_color = generate_planet_color()  # Generate a base color for the planet
+        self.base_color = base_color or generate_planet_color(self.rng)  # Generate a base color for the planet
+        self.ring_node = None
         self.create_planet()
         if self.has_rings:
             self.create_rings()
 
 
-    def create_planet(self):
-        format = GeomVertexFormat.getV3n3c4()
-        vdata = GeomVertexData("planet", format, Geom.UHDynamic)
+    def reset(self, radius=1.0, pos=(0, 0, 0), has_rings=False, ring_color=(1, 1, 1, 0.5), base_color=None,
+              seed=None):
+        """
+        Reuses this planet with new parameters (see ObjectPool). Nothing is
+        reallocated, the ring vertices are rewritten in place.
+        """
+        self.rng = np.random.default_rng(seed)
+        self.radius = radius
+        self.position = pos
+        self.has_rings = has_rings
+        self.ring_color = ring_color
+        self.base_color = base_color or generate_planet_color(self.rng)
 
-        vertex = GeomVertexWriter(vdata, "vertex")
-        normal = GeomVertexWriter(vdata, "normal")
-        color = GeomVertexWriter(vdata, "color")
+        self.planet_material.setEmission(self.base_color)
+        self.planet_np.setMaterial(self.planet_material, 1)
+        self.planet_np.setPos(*self.position)
+        self.planet_np.setScale(self.radius)
+        set_sphere_lod_radius(self.planet_np, self.radius)
+        self.planet_np.setColorScale(*self.base_color)
 
+        if self.has_rings and self.ring_node is None:
+            self.create_rings()
+        elif self.ring_node is not None:
+            if self.has_rings:
+                fill_vertex_data(self.ring_node.node().modifyGeom(0).modifyVertexData(),
+                                 self.ring_columns(*self.ring_args))
+                self.ring_node.setPos(*self.position)
+                self.ring_node.show()
+            else:
+                self.ring_node.hide()
 
-        num_segments = 32
 
-        # Generate vertices for the planet
-        for i in range(num_segments + 1):
-            for j in range(num_segments + 1):
-                theta = (i / num_segments) * 2 * math.pi
-                phi = (j / num_segments) * math.pi
+    @staticmethod
+    def extent(radius=1.0, has_rings=False, **params):
+        # Radius of the space Planet(**params) takes up, rings included (see SpatialIndex)
+        return radius * 1.5 if has_rings else radius
 
-                x = self.radius * math.sin(phi) * math.cos(theta)
-                y = self.radius * math.sin(phi) * math.sin(theta)
-                z = self.radius * math.cos(phi)
 
-                vertex.addData3f(x, y, z)
-                normal.addData3f(x, y, z)
+    def detach(self):
+        # Takes the planet out of the scene but keeps everything around for reset()
+        self.node.detachNode()
 
-                color_variation = (random.uniform(-0.05, 0.05) for _ in range(3))
-                varied_color = tuple(min(max(bc + cv, 0), 1) for bc, cv in zip(self.base_color[:3], color_variation))
-                color.addData4f(*varied_color, 1.0)  # Add alpha value of 1
 
-        # Generate triangles
-        prim = GeomTriangles(Geom.UHDynamic)
-        for i in range(num_segments):
-            for j in range(num_segments):
-                next_i = (i + 1)
-                next_j = (j + 1)
+    def destroy(self):
+        self.node.removeNode()
 
-                i0 = i * (num_segments + 1) + j
-                i1 = i * (num_segments + 1) + next_j
-                i2 = next_i * (num_segments + 1) + j
-                i3 = next_i * (num_segments + 1) + next_j
 
-                prim.addVertices(i0, i2, i1)
-                prim.addVertices(i1, i2, i3)
+    def static_geometry(self):
+        # Only the rings, the sphere is an LODNode that has to keep switching
+        if self.has_rings and self.ring_node is not None:
+            return [self.ring_node]
+        return []
 
-        prim.closePrimitive()
-        geom = Geom(vdata)
-        geom.addPrimitive(prim)
-        node = GeomNode("planet")
-        node.addGeom(geom)
+
+    def create_planet(self):
+        # Shared unit spheres at several levels of detail, tinted slightly per vertex
+        # and colored by base_color below
+        planet_np = make_sphere_lod("planet", self.radius, min_tint=0.9)
 
         planet_material = Material()
         planet_material.setShininess(100)
         planet_material.setEmission(self.base_color)
 
-        planet_np = NodePath(node)
         planet_np.setMaterial(planet_material, 1)
         planet_np.reparentTo(self.node)
         planet_np.setPos(*self.position)
+        planet_np.setScale(self.radius)
+        planet_np.setColorScale(*self.base_color)
+
+        self.planet_material = planet_material
+        self.planet_np = planet_np
 
 
     def create_rings(self, segments=100, color=(1, 0.9, 0.8, 0.3)):
         """
         Creates rings around the planet with specified parameters.
         """
-        inner_radius = self.radius * 1.2
-        outer_radius = self.radius * 1.5
-
-        format = GeomVertexFormat.getV3n3c4()
-        vdata = GeomVertexData('rings', format, Geom.UHDynamic)
-        vertex = GeomVertexWriter(vdata, 'vertex')
-        normal = GeomVertexWriter(vdata, 'normal')
-        color_writer = GeomVertexWriter(vdata, 'color')
-
-        for i in range(segments + 1):
-            angle = 2 * np.pi * i / segments
-            for radius in (inner_radius, outer_radius):
-                x = radius * np.cos(angle)
-                y = radius * np.sin(angle)
-                z = 0  # equatorial shape, so z is constant
-                
-                vertex.addData3f(x, y, z)
-                normal.addData3f(0, 0, 1)  # normal points along the z-axis
-                color_writer.addData4f(*color)
-
-        # Create the triangles
-        prim = GeomTriangles(Geom.UHDynamic)
-        for i in range(segments):
-            start_index = i * 2
-            prim.addVertices(start_index, start_index + 1, start_index + 3)
-            prim.addVertices(start_index, start_index + 3, start_index + 2)
+        self.ring_args = (segments, color)
+
+        format = vertex_format('ring')
+        vdata = GeomVertexData('rings', format, Geom.UHStatic)
+        fill_vertex_data(vdata, self.ring_columns(segments, color))
+
+        # Two triangles per segment between the inner and outer edge
+        start_index = np.arange(segments)[:, None] * 2
+        indices = (start_index + np.array([0, 1, 3, 0, 3, 2])).reshape(-1)
 
         geom = Geom(vdata)
-        geom.addPrimitive(prim)
+        geom.addPrimitive(make_triangles(indices))
         node = GeomNode('ring_node')
         node.addGeom(geom)
         ring_node = NodePath(node)
         ring_node.reparentTo(self.node)  # attach to planet's node
 
         ring_node.setPos(*self.position)
-        
-def generate_random_color() -> tuple:
-    r = random.random()
-    g = random.random()
-    b = random.random()
+        self.ring_node = ring_node
+
+
+    def ring_columns(self, segments, color):
+        # Inner and outer edge vertex for every segment boundary, in the equatorial plane
+        angle = 2 * np.pi * np.arange(segments + 1) / segments
+        radii = self.radius * np.array([1.2, 1.5])
+
+        vertices = np.zeros((segments + 1, 2, 3), dtype=np.float32)
+        vertices[..., 0] = np.cos(angle)[:, None] * radii
+        vertices[..., 1] = np.sin(angle)[:, None] * radii
+
+        num_vertices = (segments + 1) * 2
+        return {
+            'vertex': vertices.reshape(num_vertices, 3),
+            'color': np.broadcast_to(np.asarray(color, dtype=np.float32), (num_vertices, 4)),
+        }
+
+
+def generate_random_color(rng=None) -> tuple:
+    rng = np.random.default_rng(rng)
+    r = float(rng.random())
+    g = float(rng.random())
+    b = float(rng.random())
     a = 1.0
     return r, g, b, a
 
 
-def generate_planet_color():
+def generate_planet_color(rng=None):
     """
-    Generates more realistic planet colors.
+    Generates more realistic planet colors. Pass a seeded numpy Generator to make it reproducible.
     """
+    rng = np.random.default_rng(rng)
     colors = [
         (0.2, 0.5, 1.0, 1),  # Earth-like blue
         (1.0, 0.5, 0.2, 1),  # Mars-like red
         (0.9, 0.8, 0.7, 1),  # Venus-like yellow
         (0.5, 0.3, 0.0, 1),  # Mercury-like brown
         (0.9, 0.9, 0.9, 1),   # Moon-like gray,
-        generate_random_color(),
+        generate_random_color(rng),
     ]
-    return random.choice(colors)
+    return colors[rng.integers(len(colors))]
 
 
 if __name__ == '__main__':
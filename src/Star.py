@@ -1,6 +1,4 @@
-from panda3d.core import (NodePath, GeomNode, Geom, GeomVertexFormat, GeomVertexData,
-                          GeomVertexWriter, GeomTriangles, PointLight, AmbientLight, Vec4,
-                          Material, Plane, PlaneNode)
+from panda3d.core import NodePath, PointLight, AmbientLight, Vec4, Material, Plane, PlaneNode
 from direct.showbase.ShowBase import ShowBase
 from direct.filter.CommonFilters import CommonFilters
 from direct.task import Task
@@ -8,72 +6,62 @@ import random
 import numpy as np
 from panda3d.core import CardMaker
 from Planet import Planet
+from mesh import make_sphere_lod, set_sphere_lod_radius
+from star_animation import StarAnimator
+
+
+# Radians per second of the light's pulsation, see StarAnimator
+PULSE_SPEED = 0.5
+
 
 class Star:
 
-    def __init__(self, radius=1.0, pos=(0, 0, 0)):
+    def __init__(self, radius=1.0, pos=(0, 0, 0), seed=None):
         self.radius = radius
         self.position = pos
+        self.phase = np.random.default_rng(seed).uniform(0, 2 * np.pi)  # so stars don't all pulse together
+        self.pulse_speed = PULSE_SPEED
         self.node = self.create_star()
 
 
-    def animate_light(self, task):
-        # Sine wave for smooth pulsation
-        pulsation_speed = 0.5  # adjust for faster or slower pulsation
-        brightness = (np.sin(task.time * pulsation_speed) + 1) / 2  # normalized between 0 and 1
-
-        # Update the light color and intensity
-        light_color = Vec4(brightness, brightness, brightness, 1)
-        self.star_light.setColor(light_color)
-
-        return Task.cont
-
-
-    def create_star(self):
-        format = GeomVertexFormat.getV3n3c4()
-        vdata = GeomVertexData("star", format, Geom.UHDynamic)
+    def reset(self, radius=1.0, pos=(0, 0, 0), seed=None):
+        """
+        Reuses this star with new parameters (see ObjectPool).
+        """
+        self.radius = radius
+        self.position = pos
+        self.phase = np.random.default_rng(seed).uniform(0, 2 * np.pi)
+        self.node.setPos(self.position)
+        self.sphere_np.setScale(self.radius)
+        set_sphere_lod_radius(self.sphere_np, self.radius)
 
-        vertex = GeomVertexWriter(vdata, "vertex")
-        normal = GeomVertexWriter(vdata, "normal")
-        color = GeomVertexWriter(vdata, "color")
 
-        num_segments = 32
+    @staticmethod
+    def extent(radius=1.0, **params):
+        return radius
 
-        for i in range(num_segments + 1):
-            for j in range(num_segments + 1):
-                theta = (i / num_segments) * 2 * np.pi
-                phi = (j / num_segments) * np.pi
 
-                x = self.radius * np.sin(phi) * np.cos(theta)
-                y = self.radius * np.sin(phi) * np.sin(theta)
-                z = self.radius * np.cos(phi)
+    def release_light(self):
+        # A LightManager decides where the light is enabled from now on
+        self.node.clearLight(self.light_node)
 
-                vertex.addData3f(x, y, z)
-                normal.addData3f(x, y, z)
-                color.addData4f(generate_random_star_color())
 
-        prim = GeomTriangles(Geom.UHDynamic)
-        for i in range(num_segments):
-            for j in range(num_segments):
-                next_i = (i + 1)
-                next_j = (j + 1)
+    def detach(self):
+        self.node.detachNode()
 
-                i0 = i * (num_segments + 1) + j
-                i1 = i * (num_segments + 1) + next_j
-                i2 = next_i * (num_segments + 1) + j
-                i3 = next_i * (num_segments + 1) + next_j
 
-                prim.addVertices(i0, i2, i1)
-                prim.addVertices(i1, i2, i3)
+    def destroy(self):
+        self.node.removeNode()
 
-        prim.closePrimitive()
-        geom = Geom(vdata)
-        geom.addPrimitive(prim)
-        node = GeomNode("star")
-        node.addGeom(geom)
 
-        star_node = NodePath(node)
+    def create_star(self):
+        # Shared unit spheres at several levels of detail -- the template tint is in the
+        # same 0.8-1.0 range as generate_random_star_color
+        star_node = NodePath("star_node")
         star_node.setPos(self.position)
+        self.sphere_np = make_sphere_lod("star", self.radius, min_tint=0.8)
+        self.sphere_np.reparentTo(star_node)
+        self.sphere_np.setScale(self.radius)
 
         star_material = Material()
         star_material.setShininess(100)
@@ -89,14 +77,14 @@ class Star:
         star_light.setAttenuation((0, 0.0001, 0.0001))
         star_light_node = star_node.attachNewNode(star_light)
         star_node.setLight(star_light_node)
+        self.light_node = star_light_node
 
         return star_node
     
     
-def generate_random_star_color():
-    r = random.uniform(0.8, 1.0)
-    g = random.uniform(0.8, 1.0)
-    b = random.uniform(0.8, 1.0)
+def generate_random_star_color(rng=None):
+    rng = np.random.default_rng(rng)
+    r, g, b = (float(c) for c in rng.uniform(0.8, 1.0, 3))
     return r, g, b, 1.0
 
 
@@ -112,16 +100,12 @@ class StarApp(ShowBase):
         star_node = self.star_instance.node
         star_node.reparentTo(self.render)
 
-        # Assign the PointLight created in Star to an attribute for access
-        self.star_instance.star_light = PointLight('star_light')
-        self.star_instance.star_light.setColor((1, 1, 1, 1))
-        self.star_instance.star_light.setAttenuation((0, 0.0001, 0.0001))
-        star_light_node = star_node.attachNewNode(self.star_instance.star_light)
-        star_node.setLight(star_light_node)
+ 
+        # Pulsate the star's light
+        self.star_animator = StarAnimator()
+        self.star_animator.add(self.star_instance)
+        self.taskMgr.add(self.animate_stars, "animate_stars")
 
-        # Add a task to animate the light
-        self.taskMgr.add(self.star_instance.animate_light, "animate_light")
-        
 
         # Enable bloom effect for glow
         filters = CommonFilters(base.win, base.cam)
@@ -133,6 +117,10 @@ class StarApp(ShowBase):
         #self.add_spheres_around_star()
         self.add_planets_around_star()
 
+    def animate_stars(self, task):
+        self.star_animator.update(task.time)
+        return Task.cont
+
     def add_ground(self):
         # Create a ground plane
         cm = CardMaker("ground")
@@ -0,0 +1,128 @@
+"""
+Headless benchmarks for object construction and SpaceScene frames.
+
+    python benchmark.py [--frames 300] [--samples 50] [--window-type none|offscreen] [--output results.json]
+
+Prints (or writes) JSON with the median and percentiles of every timing in
+milliseconds, so runs can be compared on a machine without a display. With
+--window-type offscreen the frames are actually rendered, into a buffer.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import numpy as np
+from panda3d.core import loadPrcFileData
+
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def summarize(times):
+    """
+    Summary statistics of a list of timings in seconds, reported in milliseconds.
+    """
+    ms = np.asarray(times) * 1000.0
+    summary = {'count': len(ms), 'mean': float(ms.mean()), 'min': float(ms.min()), 'max': float(ms.max())}
+    for p, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+        summary['p{}'.format(p)] = float(value)
+    summary['median'] = summary['p50']
+    return summary
+
+
+def time_construction(cls, make_params, samples, rng):
+    # Builds and destroys one object per sample, with params drawn from the ranges sectors use
+    times = []
+    for _ in range(samples):
+        params = make_params(rng)
+        params['seed'] = rng.randrange(2 ** 32)
+        start = time.perf_counter()
+        obj = cls(**params)
+        times.append(time.perf_counter() - start)
+        obj.destroy()
+    return summarize(times)
+
+
+def position(rng):
+    return tuple(rng.uniform(-300, 300) for _ in range(3))
+
+
+def bench_objects(samples, seed=0):
+    from Comet import Comet
+    from Nebula import Nebula
+    from Planet import Planet
+    from Star import Star
+
+    cases = {
+        'planet': (Planet, lambda rng: dict(radius=rng.uniform(5.0, 100.0), pos=position(rng))),
+        'planet_rings': (Planet, lambda rng: dict(radius=rng.uniform(5.0, 100.0), pos=position(rng),
+                                                  has_rings=True, ring_color=(1, 0.9, 0.8, 0.3))),
+        'star': (Star, lambda rng: dict(radius=rng.uniform(0.5, 1.5), pos=position(rng))),
+        'comet': (Comet, lambda rng: dict(radius=rng.uniform(4, 15), pos=position(rng),
+                                          velocity=(rng.uniform(1, 5.0), 0, rng.uniform(1, 5.0)))),
+        'nebula': (Nebula, lambda rng: dict(scale=rng.uniform(0.5, 4.0), pos=position(rng),
+                                            num_arms=rng.randint(2, 5), points_per_arm=rng.randint(200, 2000),
+                                            thickness=rng.uniform(0.1, 1))),
+    }
+    results = {}
+    for name, (cls, make_params) in cases.items():
+        results[name] = time_construction(cls, make_params, samples, random.Random(seed))
+    return results
+
+
+def bench_frames(scene, frames, speed):
+    """
+    Flies the camera forward `speed` units per frame, so sectors keep streaming
+    in, and times every taskMgr step (all of SpaceScene's tasks, plus rendering
+    when there is a buffer).
+    """
+    times = []
+    for _ in range(frames):
+        scene.camera.setY(scene.camera, speed)
+        start = time.perf_counter()
+        scene.taskMgr.step()
+        times.append(time.perf_counter() - start)
+
+    return {
+        'frame': summarize(times),
+        'objects': len(scene.procedural_objects),
+        'eviction': scene.eviction_stats(),
+        'pool': scene.pool.stats(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=300, help="SpaceScene frames to time")
+    parser.add_argument('--samples', type=int, default=50, help="objects built per construction benchmark")
+    parser.add_argument('--speed', type=float, default=10.0, help="camera movement per frame")
+    parser.add_argument('--seed', type=int, default=0, help="world seed")
+    parser.add_argument('--window-type', choices=('none', 'offscreen'), default='none')
+    parser.add_argument('--cache-dir', help="geometry cache to use, none by default so every run builds")
+    parser.add_argument('--output', help="write the JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    loadPrcFileData('benchmark', 'audio-library-name null\nsync-video false\nwin-size 640 360')
+
+    from procedural_generation import SpaceScene
+    scene = SpaceScene(world_seed=args.seed, window_type=args.window_type, cache_dir=args.cache_dir)
+
+    results = {
+        'window_type': args.window_type,
+        'construction': bench_objects(args.samples, args.seed),
+        'scene': bench_frames(scene, args.frames, args.speed),
+    }
+    scene.pipeline.shutdown()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
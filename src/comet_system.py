@@ -0,0 +1,102 @@
+from panda3d.core import GeomNode, Geom, GeomVertexData, GeomPoints, RenderModeAttrib, TransparencyAttrib
+import numpy as np
+
+from mesh import fill_vertex_data, vertex_format
+from packed_arrays import PackedArrays
+
+
+class CometSystem:
+    """
+    Moves every active comet in one numpy step per frame instead of each Comet
+    running its own update.
+
+    Positions, velocities and trails live in PackedArrays, one row per comet. All the
+    trails are drawn from a single world space point Geom, so the comets' own
+    trail nodes are hidden while they're in the system.
+
+    With a SpatialIndex, the comets are moved in it too.
+    """
+
+    def __init__(self, parent, trail_capacity=100, point_size=5, index=None):
+        self.trail_capacity = trail_capacity
+        self.index = index
+        self.comets = PackedArrays(positions=np.zeros((0, 3)), velocities=np.zeros((0, 3)),
+                                   trail_positions=np.zeros((0, trail_capacity, 3), dtype=np.float32),
+                                   trail_counts=np.zeros(0, dtype=np.int64),
+                                   trail_colors=np.zeros((0, 4), dtype=np.float32))
+        self.trail_head = 0
+
+        format = vertex_format('trail')
+        geom = Geom(GeomVertexData('comet_trails', format, Geom.UHDynamic))
+        geom.addPrimitive(GeomPoints(Geom.UHStatic))
+        node = GeomNode('comet_trails')
+        node.addGeom(geom)
+
+        self.trail_np = parent.attachNewNode(node)
+        self.trail_np.setBin("fixed", 0)
+        self.trail_np.setDepthWrite(False)
+        self.trail_np.setTransparency(TransparencyAttrib.MAlpha)
+        self.trail_np.setRenderMode(RenderModeAttrib.MPoint, point_size)
+
+    def add(self, comet):
+        self.comets.add(comet, positions=comet.position, velocities=comet.velocity,
+                        trail_positions=np.zeros((self.trail_capacity, 3)), trail_counts=0,
+                        trail_colors=comet.trail_colors[0])
+        comet.trail_node.hide()
+        self.resize_trails()
+
+    def remove(self, comet):
+        """
+        Takes the comet out of the system, leaving it where it got to.
+        """
+        comet.position = tuple(float(p) for p in self.comets.positions[self.comets.slots[comet]])
+        comet.trail_node.show()
+        self.comets.remove(comet)
+        self.resize_trails()
+
+    def resize_trails(self):
+        points = self.trail_np.node().modifyGeom(0).modifyPrimitive(0)
+        points.clearVertices()
+        if self.comets:
+            points.addNextVertices(len(self.comets) * self.trail_capacity)
+            points.closePrimitive()
+        self.write_trails()
+
+    def update(self, dt):
+        comets = self.comets
+        if not comets:
+            return
+        comets.positions += comets.velocities * dt
+
+        self.trail_head = (self.trail_head + 1) % self.trail_capacity
+        comets.trail_positions[:, self.trail_head] = comets.positions
+        np.minimum(comets.trail_counts + 1, self.trail_capacity, out=comets.trail_counts)
+        self.write_trails()
+
+        for comet, pos in zip(comets.items, comets.positions.tolist()):
+            comet.node.setPos(*pos)
+            if self.index is not None and comet in self.index:
+                self.index.move(comet, pos)
+
+    def write_trails(self):
+        comets = self.comets
+        num_comets = len(comets)
+        decay = 1.0 / self.trail_capacity
+        # Ages in frames of every slot, newest is 0. Same layout as Comet.write_trail, one row per comet
+        ages = (self.trail_head - np.arange(self.trail_capacity)) % self.trail_capacity
+        alpha = np.where(ages[None, :] < comets.trail_counts[:, None], 1.0 - (ages + 1) * decay, 0)
+
+        colors = np.repeat(comets.trail_colors[:, None, :], self.trail_capacity, axis=1)
+        colors[:, :, 3] = alpha
+
+        vdata = self.trail_np.node().modifyGeom(0).modifyVertexData()
+        fill_vertex_data(vdata, {
+            'vertex': comets.trail_positions.reshape(num_comets * self.trail_capacity, 3),
+            'color': colors.reshape(num_comets * self.trail_capacity, 4),
+        })
+
+    def stats(self):
+        return {
+            'comets': len(self.comets),
+            'trail_points': len(self.comets) * self.trail_capacity,
+        }
@@ -0,0 +1,165 @@
+from panda3d.core import BoundingVolume
+
+
+def geometry_size(node):
+    """
+    Returns (vertices, bytes) of all the geometry under node. GeomNodes tagged
+    'shared' (the sphere templates of mesh.make_sphere_lod) are left out: they're
+    instanced into every body, exist once whatever the number of bodies, and
+    freeing a body frees none of it.
+    """
+    num_vertices = 0
+    num_bytes = 0
+    geom_nodes = list(node.findAllMatches('**/+GeomNode'))
+    if node.node().isGeomNode():
+        geom_nodes.append(node)
+
+    for geom_np in geom_nodes:
+        geom_node = geom_np.node()
+        if geom_node.hasTag('shared'):
+            continue
+        for i in range(geom_node.getNumGeoms()):
+            vdata = geom_node.getGeom(i).getVertexData()
+            num_vertices += vdata.getNumRows()
+            for a in range(vdata.getNumArrays()):
+                num_bytes += vdata.getArray(a).getDataSizeBytes()
+    return num_vertices, num_bytes
+
+
+def object_size(obj, batched=False):
+    """
+    Returns (vertices, bytes) of an object, counting its static geometry twice when
+    a StaticBatcher holds a copy of it.
+    """
+    num_vertices, num_bytes = geometry_size(obj.node)
+    if batched:
+        for geom_np in obj.static_geometry():
+            copy_vertices, copy_bytes = geometry_size(geom_np)
+            num_vertices += copy_vertices
+            num_bytes += copy_bytes
+    return num_vertices, num_bytes
+
+
+class TrackedObject:
+
+    def __init__(self, obj, now, batched=False):
+        self.obj = obj
+        self.batched = batched
+        self.num_vertices, self.num_bytes = object_size(obj, batched)
+        self.last_visible = now
+        self.distance = 0.0
+        # objects built over several frames get measured again once they're complete
+        self.building = hasattr(obj, 'is_built') and not obj.is_built()
+
+
+class Evictor:
+    """
+    Keeps the procedural objects within a budget.
+
+    Objects further than max_distance from the camera, or out of view for longer
+    than max_hidden_time seconds, are always evicted. On top of that, while the
+    live objects are over max_objects / max_vertices / max_bytes, the ones with the
+    highest distance * (1 + seconds hidden) go first. Any limit can be None.
+
+    With a StaticBatcher, the copies it makes of the objects' static geometry count
+    towards the budget too, as part of the objects they were copied from.
+    """
+
+    def __init__(self, max_objects=None, max_vertices=None, max_bytes=None,
+                 max_distance=None, max_hidden_time=None, batcher=None):
+        self.max_objects = max_objects
+        self.max_vertices = max_vertices
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        self.max_hidden_time = max_hidden_time
+        self.batcher = batcher
+
+        self.tracked = {}
+        self.num_vertices = 0
+        self.num_bytes = 0
+        self.evicted = {'distance': 0, 'hidden': 0, 'budget': 0}
+
+    def track(self, obj, now):
+        entry = TrackedObject(obj, now, self.batched(obj))
+        self.tracked[obj] = entry
+        self.num_vertices += entry.num_vertices
+        self.num_bytes += entry.num_bytes
+
+    def forget(self, obj):
+        entry = self.tracked.pop(obj, None)
+        if entry is not None:
+            self.num_vertices -= entry.num_vertices
+            self.num_bytes -= entry.num_bytes
+
+    def batched(self, obj):
+        return self.batcher is not None and self.batcher.is_batched(obj)
+
+    def remeasure(self, entry):
+        self.num_vertices -= entry.num_vertices
+        self.num_bytes -= entry.num_bytes
+        entry.batched = self.batched(entry.obj)
+        entry.num_vertices, entry.num_bytes = object_size(entry.obj, entry.batched)
+        entry.building = False
+        self.num_vertices += entry.num_vertices
+        self.num_bytes += entry.num_bytes
+
+    def over_budget(self, num_objects, num_vertices, num_bytes):
+        return ((self.max_objects is not None and num_objects > self.max_objects) or
+                (self.max_vertices is not None and num_vertices > self.max_vertices) or
+                (self.max_bytes is not None and num_bytes > self.max_bytes))
+
+    def update(self, camera, lens, now):
+        """
+        Refreshes distance and visibility of every tracked object and returns the
+        ones to evict. The caller is responsible for removing them (and calling forget).
+        """
+        lens_bounds = lens.makeBounds()
+        evict = []
+        for entry in self.tracked.values():
+            if (entry.building and entry.obj.is_built()) or entry.batched != self.batched(entry.obj):
+                self.remeasure(entry)
+
+            node = entry.obj.node
+            bounds = node.getBounds().makeCopy()
+            if bounds.isEmpty():
+                continue
+            # getBounds() already has the node's own transform in it, so it's in the parent's space
+            bounds.xform(node.getParent().getMat(camera))
+            entry.distance = bounds.getCenter().length()
+            if lens_bounds.contains(bounds) != BoundingVolume.IF_no_intersection:
+                entry.last_visible = now
+
+            if self.max_distance is not None and entry.distance > self.max_distance:
+                self.evicted['distance'] += 1
+                evict.append(entry)
+            elif self.max_hidden_time is not None and now - entry.last_visible > self.max_hidden_time:
+                self.evicted['hidden'] += 1
+                evict.append(entry)
+
+        num_objects = len(self.tracked) - len(evict)
+        num_vertices = self.num_vertices - sum(entry.num_vertices for entry in evict)
+        num_bytes = self.num_bytes - sum(entry.num_bytes for entry in evict)
+        if self.over_budget(num_objects, num_vertices, num_bytes):
+            already = set(id(entry) for entry in evict)
+            candidates = sorted((entry for entry in self.tracked.values() if id(entry) not in already),
+                                key=lambda entry: entry.distance * (1 + now - entry.last_visible),
+                                reverse=True)
+            for entry in candidates:
+                if not self.over_budget(num_objects, num_vertices, num_bytes):
+                    break
+                self.evicted['budget'] += 1
+                evict.append(entry)
+                num_objects -= 1
+                num_vertices -= entry.num_vertices
+                num_bytes -= entry.num_bytes
+
+        return [entry.obj for entry in evict]
+
+    def stats(self):
+        return {
+            'objects': len(self.tracked),
+            'vertices': self.num_vertices,
+            'bytes': self.num_bytes,
+            'evicted': dict(self.evicted),
+            'evicted_total': sum(self.evicted.values()),
+        }
@@ -0,0 +1,79 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SpawnRequest:
+
+    def __init__(self, kind, params, tag, future):
+        self.kind = kind
+        self.params = params
+        self.tag = tag
+        self.future = future
+        self.cancelled = False
+
+
+class GenerationPipeline:
+    """
+    Builds geometry for spawn requests on a pool of worker threads.
+
+    `prebuilders` maps a kind to a function taking that kind's constructor params and
+    returning a dict of extra params with the heavy numpy work already done (for
+    example Nebula.prebuild -> points=). It must not touch panda, only the main
+    thread does that. Kinds without a prebuilder have nothing to do off-thread.
+
+    Finished requests are handed back to the main thread in submission order with
+    peek() / take(); the SpawnScheduler decides how many of them fit in a frame.
+    """
+
+    def __init__(self, prebuilders, max_workers=None):
+        self.prebuilders = prebuilders
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+        self.pending = deque()
+
+    def submit(self, kind, params, tag=None):
+        """
+        Queues a spawn. tag is handed back by take() untouched (the sector, for example).
+        """
+        prebuild = self.prebuilders.get(kind)
+        future = self.executor.submit(prebuild, **params) if prebuild else None
+        request = SpawnRequest(kind, params, tag, future)
+        self.pending.append(request)
+        return request
+
+    def cancel(self, tag):
+        """
+        Drops every pending request with this tag, e.g. for a sector that was unloaded.
+        """
+        for request in self.pending:
+            if request.tag is tag:
+                request.cancelled = True
+                if request.future is not None:
+                    request.future.cancel()
+
+    def peek(self):
+        """
+        Returns the next request if it has finished building, None otherwise.
+        """
+        while self.pending and self.pending[0].cancelled:
+            self.pending.popleft()
+        if not self.pending:
+            return None
+        request = self.pending[0]
+        if request.future is not None and not request.future.done():
+            return None
+        return request
+
+    def take(self):
+        """
+        Pops the request returned by peek() as (kind, params, tag), with the
+        prebuilt results merged into params.
+        """
+        request = self.pending.popleft()
+        params = request.params
+        if request.future is not None:
+            params = dict(params, **request.future.result())
+        return request.kind, params, request.tag
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.pending.clear()
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+import hashlib
+import os
+import shutil
+import threading
+
+import numpy as np
+
+
+# Bump when a generator changes what it outputs for the same params, so old entries miss
+CACHE_VERSION = 2
+
+# Params that don't change the generated arrays (where the object goes, how it's shown)
+IGNORED_PARAMS = {'pos', 'incremental', 'fade_in', 'point_size'}
+
+
+def cache_key(kind, params):
+    """
+    Content address of the geometry for kind(**params), or None when it can't be
+    cached because there's no seed (the result would be different every time).
+    """
+    if params.get('seed') is None:
+        return None
+    items = sorted((name, value) for name, value in params.items() if name not in IGNORED_PARAMS)
+    return hashlib.sha1(repr((CACHE_VERSION, kind, items)).encode()).hexdigest()
+
+
+class GeometryCache:
+    """
+    On-disk cache of prebuilt geometry (see GenerationPipeline), one directory per
+    entry with one .npy file per array, so hits are memory-mapped instead of read.
+
+    cached(kind, prebuild) wraps a prebuilder so a warm cache turns the numpy work
+    into a load. The least recently used entries are deleted once the cache grows
+    past max_bytes. Safe to use from the worker threads.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> bytes, oldest first
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if '.tmp' in name:
+                shutil.rmtree(path, ignore_errors=True)  # left over from an interrupted put()
+            elif os.path.isdir(path):
+                found.append((os.path.getmtime(path), name, self.entry_size(path)))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.num_bytes += size
+
+    def entry_size(self, path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    def get(self, key):
+        """
+        Returns the cached result for key, with read-only memory-mapped arrays, or None.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        path = os.path.join(self.directory, key)
+        try:
+            os.utime(path)  # so the LRU order survives a restart
+            result = {}
+            for name in os.listdir(path):
+                outer, _, inner = name[:-len('.npy')].partition('.')
+                array = np.load(os.path.join(path, name), mmap_mode='r')
+                if inner:
+                    result.setdefault(outer, {})[inner] = array
+                else:
+                    result[outer] = array
+            return result
+        except OSError:
+            # evicted by another thread in the meantime
+            return None
+
+    def put(self, key, result):
+        """
+        Stores a prebuild result: a dict of arrays, or of dicts of arrays (like points=).
+        """
+        path = os.path.join(self.directory, key)
+        tmp_path = '{}.tmp{}'.format(path, threading.get_ident())
+        os.makedirs(tmp_path, exist_ok=True)
+        for outer, value in result.items():
+            columns = value.items() if isinstance(value, dict) else [(None, value)]
+            for inner, array in columns:
+                name = outer if inner is None else '{}.{}'.format(outer, inner)
+                np.save(os.path.join(tmp_path, name + '.npy'), np.ascontiguousarray(array))
+        size = self.entry_size(tmp_path)
+
+        with self.lock:
+            if key in self.entries:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                return
+            os.replace(tmp_path, path)
+            self.entries[key] = size
+            self.num_bytes += size
+            while self.num_bytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.num_bytes -= old_size
+                shutil.rmtree(os.path.join(self.directory, old_key), ignore_errors=True)
+
+    def cached(self, kind, prebuild):
+        """
+        Wraps prebuild(**params) so results are looked up in and added to the cache.
+        """
+        def cached_prebuild(**params):
+            key = cache_key(kind, params)
+            if key is None:
+                return prebuild(**params)
+            result = self.get(key)
+            if result is None:
+                result = prebuild(**params)
+                if result:
+                    self.put(key, result)
+            return result
+        return cached_prebuild
+
+    def clear(self):
+        with self.lock:
+            for key in self.entries:
+                shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            self.entries.clear()
+            self.num_bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.num_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
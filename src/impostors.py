@@ -0,0 +1,254 @@
+from panda3d.core import (NodePath, Camera, OrthographicLens, CardMaker, Texture, GraphicsOutput,
+                          GraphicsPipe, FrameBufferProperties, WindowProperties, LightAttrib,
+                          TransparencyAttrib, ColorBlendAttrib, Vec3)
+
+
+class Impostor:
+
+    def __init__(self, obj, additive):
+        self.obj = obj
+        self.additive = additive
+        self.tile = None
+        self.card = None
+        self.direction = None  # camera to object when the tile was captured
+        self.active = False    # card shown instead of the object
+        self.suspended = False
+        self.capturing = False
+
+
+class ImpostorManager:
+    """
+    Draws objects further than `distance` from the camera as camera-facing cards,
+    snapshotted into tiles of one shared atlas texture. Needs a window.
+    """
+
+    def __init__(self, parent, distance=800.0, tile_size=128, atlas_size=2048, max_angle=10.0,
+                 max_captures=8, batcher=None):
+        self.distance = distance
+        self.tile_size = tile_size
+        self.max_angle = max_angle
+        self.max_captures = max_captures
+        self.batcher = batcher
+        self.impostors = {}
+        self.captures = []
+        self.captured = 0
+
+        tiles_per_row = atlas_size // tile_size
+        self.tiles_per_row = tiles_per_row
+        self.free_tiles = [(col, row) for row in range(tiles_per_row) for col in range(tiles_per_row)][::-1]
+
+        self.node = parent.attachNewNode('impostors')
+        self.capture_root = NodePath('impostor_capture')
+        self.buffer = self.make_buffer(atlas_size)
+        if self.buffer is None:
+            return
+
+        self.atlas = self.buffer.getTexture()
+        self.node.setTexture(self.atlas)
+        self.node.setLightOff()
+        self.node.setDepthWrite(False)
+        self.node.setTransparency(TransparencyAttrib.MAlpha)
+        self.cards = self.node.attachNewNode('cards')
+        # Nebulae are drawn additively, so are their cards
+        self.additive_cards = self.node.attachNewNode('additive_cards')
+        self.additive_cards.setAttrib(ColorBlendAttrib.make(ColorBlendAttrib.MAdd))
+
+    def make_buffer(self, size):
+        win = getattr(base, 'win', None)
+        if win is None or win.getGsg() is None:
+            return None
+
+        fb_props = FrameBufferProperties()
+        fb_props.setRgbaBits(8, 8, 8, 8)
+        fb_props.setDepthBits(16)
+        # A parasite buffer would share the window's framebuffer, which is cleared every frame
+        buffer = base.graphicsEngine.makeOutput(
+            win.getPipe(), 'impostor_atlas', -10, fb_props, WindowProperties.size(size, size),
+            GraphicsPipe.BFRefuseWindow | GraphicsPipe.BFRefuseParasite, win.getGsg(), win)
+        if buffer is None:
+            return None
+
+        texture = Texture('impostor_atlas')
+        texture.setMinfilter(Texture.FTLinear)
+        buffer.addRenderTexture(texture, GraphicsOutput.RTMBindOrCopy, GraphicsOutput.RTPColor)
+        # Tiles that aren't being captured keep what they have
+        buffer.setClearColorActive(False)
+        buffer.setClearDepthActive(False)
+        buffer.setActive(False)
+        return buffer
+
+    def add(self, obj, additive=False):
+        if self.buffer is not None:
+            self.impostors[obj] = Impostor(obj, additive)
+
+    def remove(self, obj):
+        impostor = self.impostors.pop(obj, None)
+        if impostor is None:
+            return
+        impostor.suspended = False  # the batcher forgets the object as well
+        self.deactivate(impostor)
+        if impostor.card is not None:
+            impostor.card.removeNode()
+        if impostor.tile is not None:
+            self.free_tiles.append(impostor.tile)
+        # The object is about to be reset for someone else (see ObjectPool), it mustn't
+        # still be instanced under a capture holder when that happens
+        for capture in [capture for capture in self.captures if capture[0] is impostor]:
+            self.end_capture(capture)
+            self.captures.remove(capture)
+
+    def update(self, camera):
+        """
+        Swaps cards and objects for a camera (a NodePath) and starts new captures.
+        """
+        if self.buffer is None:
+            return
+        self.finish_captures()
+
+        camera_pos = camera.getPos(self.node)
+        up = self.node.getRelativeVector(camera, Vec3(0, 0, 1))
+        missing = []  # no card yet, still drawn for real
+        stale = []    # card shown but seen from too far off its capture direction
+        for impostor in self.impostors.values():
+            obj = impostor.obj
+            if hasattr(obj, 'is_built') and not obj.is_built():
+                continue
+            center, radius = self.bounds(obj)
+            offset = center - camera_pos
+            distance = offset.length()
+            # a bit of slack so objects right at the distance don't flip every frame
+            far = distance > (self.distance * 0.9 if impostor.active else self.distance)
+            if not far or distance <= radius:
+                self.deactivate(impostor)
+                continue
+
+            direction = offset / distance
+            fresh = (impostor.direction is not None and
+                     direction.angleDeg(impostor.direction) <= self.max_angle)
+            if fresh:
+                self.activate(impostor)
+            elif not impostor.capturing:
+                wanted = stale if impostor.active else missing
+                wanted.append((distance, id(impostor), impostor, center, radius, direction))
+
+        if missing or len(stale) >= self.max_captures:
+            # nearest first, they're the ones where a stale or missing card shows the most
+            wanted = sorted(missing, key=lambda item: item[:2]) + sorted(stale, key=lambda item: item[:2])
+            for _, _, impostor, center, radius, direction in wanted[:self.max_captures]:
+                self.capture(impostor, center, radius, direction, up)
+
+        self.buffer.setActive(bool(self.captures))
+
+    def bounds(self, obj):
+        # World space center and radius of the object's geometry. getBounds() already
+        # includes the node's own transform, so it's in the parent's space
+        bounds = obj.node.getBounds()
+        parent = obj.node.getParent()
+        center = self.node.getRelativePoint(parent, bounds.getCenter())
+        radius = bounds.getRadius() * parent.getSx(self.node)
+        return center, radius
+
+    def capture(self, impostor, center, radius, direction, up):
+        if impostor.tile is None:
+            if not self.free_tiles and not self.steal_tile():
+                return
+            impostor.tile = self.free_tiles.pop()
+        if not impostor.suspended and self.batcher is not None:
+            # batched geometry is hidden on the object, so it has to be drawn by the object again
+            self.batcher.suspend(impostor.obj)
+            impostor.suspended = True
+
+        # Same transform as in the scene, so the lights in the main graph line up
+        holder = self.capture_root.attachNewNode('holder')
+        holder.setTransform(impostor.obj.node.getParent().getNetTransform())
+        impostor.obj.node.instanceTo(holder)
+        lights = self.node.getParent().getAttrib(LightAttrib)
+        if lights is not None:
+            holder.setAttrib(lights)
+
+        lens = OrthographicLens()
+        lens.setFilmSize(2 * radius, 2 * radius)
+        lens.setNearFar(radius, 3 * radius)
+        camera = self.capture_root.attachNewNode(Camera('impostor_camera', lens))
+        camera.setPos(center - direction * 2 * radius)
+        camera.lookAt(center, up)
+
+        col, row = impostor.tile
+        size = 1.0 / self.tiles_per_row
+        region = self.buffer.makeDisplayRegion(col * size, (col + 1) * size, row * size, (row + 1) * size)
+        region.setCamera(camera)
+        region.setClearColorActive(True)
+        region.setClearColor((0, 0, 0, 0))
+        region.setClearDepthActive(True)
+
+        impostor.capturing = True
+        self.captures.append((impostor, region, camera, holder, center, radius, direction))
+
+    def finish_captures(self):
+        # The captures started last update have been rendered by now
+        for capture in self.captures:
+            self.end_capture(capture)
+            impostor, _, _, _, center, radius, direction = capture
+            impostor.direction = direction
+            self.make_card(impostor, center, radius)
+            self.captured += 1
+        self.captures = []
+
+    def end_capture(self, capture):
+        impostor, region, camera, holder = capture[:4]
+        self.buffer.removeDisplayRegion(region)
+        camera.removeNode()
+        holder.removeNode()
+        impostor.capturing = False
+
+    def make_card(self, impostor, center, radius):
+        if impostor.card is not None:
+            impostor.card.removeNode()
+        col, row = impostor.tile
+        size = 1.0 / self.tiles_per_row
+        maker = CardMaker('impostor')
+        maker.setFrame(-radius, radius, -radius, radius)
+        maker.setUvRange((col * size, row * size), ((col + 1) * size, (row + 1) * size))
+        parent = self.additive_cards if impostor.additive else self.cards
+        impostor.card = parent.attachNewNode(maker.generate())
+        impostor.card.setPos(center)
+        impostor.card.setBillboardPointEye()
+        if not impostor.active:
+            impostor.card.hide()
+
+    def activate(self, impostor):
+        if impostor.active or impostor.card is None:
+            return
+        impostor.active = True
+        impostor.card.show()
+        impostor.obj.node.stash()
+
+    def deactivate(self, impostor):
+        if impostor.active:
+            impostor.active = False
+            impostor.card.hide()
+            impostor.obj.node.unstash()
+        if impostor.suspended and not impostor.capturing:
+            self.batcher.resume(impostor.obj)
+            impostor.suspended = False
+
+    def steal_tile(self):
+        # Atlas is full: take the tile of an object that is drawn for real right now
+        for impostor in self.impostors.values():
+            if impostor.tile is not None and not impostor.active and not impostor.capturing:
+                self.free_tiles.append(impostor.tile)
+                impostor.tile = None
+                impostor.direction = None
+                if impostor.card is not None:
+                    impostor.card.removeNode()
+                    impostor.card = None
+                return True
+        return False
+
+    def stats(self):
+        return {
+            'objects': len(self.impostors),
+            'active': sum(impostor.active for impostor in self.impostors.values()),
+            'free_tiles': len(self.free_tiles),
+            'captured': self.captured,
+        }
@@ -0,0 +1,129 @@
+from collections import deque
+import csv
+import json
+
+from direct.gui.OnscreenText import OnscreenText
+from panda3d.core import PStatClient, PStatCollector, SceneGraphAnalyzer, TextNode
+
+
+# Tasks that are part of ShowBase itself and not worth a column
+IGNORED_TASKS = {'resetPrevTransform', 'dataLoop', 'eventManager', 'ivalLoop', 'collisionLoop',
+                 'garbageCollectStates', 'audioLoop', 'instrumentation'}
+
+
+class Instrumentation:
+    """
+    Per-frame task times and scene counters for a SpaceScene, kept for save() and
+    shown in an overlay (toggle_overlay) and in PStats.
+    """
+
+    def __init__(self, scene, history=600, sample_every=30, log_path=None, log_every=300, overlay=False):
+        self.scene = scene
+        self.sample_every = sample_every
+        self.log_path = log_path
+        self.log_every = log_every
+        self.frames = deque(maxlen=history)
+        self.frame_count = 0
+        self.last_spawned = scene.spawned
+        self.last_despawned = scene.despawned
+        self.geometry = {'nodes': None, 'primitives': None}
+
+        self.collectors = {name: PStatCollector('Scene:' + name.capitalize())
+                           for name in ('objects', 'spawned', 'despawned', 'object_vertices',
+                                        'object_bytes', 'nodes', 'primitives', 'lights')}
+
+        self.text = None
+        if overlay:
+            self.toggle_overlay()
+
+        # After everything else, rendering included
+        scene.taskMgr.add(self.update, 'instrumentation', sort=100)
+
+    def toggle_overlay(self):
+        if self.text is None:
+            self.text = OnscreenText(parent=self.scene.a2dTopLeft, pos=(0.05, -0.08), scale=0.045,
+                                     fg=(1, 1, 1, 1), align=TextNode.ALeft, mayChange=True)
+        elif self.text.isHidden():
+            self.text.show()
+        else:
+            self.text.hide()
+
+    def watched(self):
+        overlay = self.text is not None and not self.text.isHidden()
+        return overlay or bool(self.log_path) or PStatClient.isConnected()
+
+    def count_geometry(self):
+        analyzer = SceneGraphAnalyzer()
+        analyzer.addNode(self.scene.render.node())
+        self.geometry = {
+            'nodes': analyzer.getNumNodes(),
+            'primitives': analyzer.getNumTris() + analyzer.getNumPoints() + analyzer.getNumLines(),
+        }
+
+    def update(self, task):
+        scene = self.scene
+        # Walking the whole scene takes a good part of a frame, so only while someone's looking
+        if not self.watched():
+            self.geometry = dict.fromkeys(self.geometry)
+        elif self.frame_count % self.sample_every == 0 or self.geometry['nodes'] is None:
+            self.count_geometry()
+
+        frame = {
+            'frame': self.frame_count,
+            'time': globalClock.getFrameTime(),
+            'dt_ms': globalClock.getDt() * 1000.0,
+            'objects': len(scene.procedural_objects),
+            'spawned': scene.spawned - self.last_spawned,
+            'despawned': scene.despawned - self.last_despawned,
+            # procedural objects only, as the evictor counts them
+            'object_vertices': scene.evictor.num_vertices,
+            'object_bytes': scene.evictor.num_bytes,
+            'lights': scene.lights.stats()['active'],
+        }
+        frame.update(self.geometry)
+        for other in scene.taskMgr.getTasks():
+            name = other.getName()
+            if name not in IGNORED_TASKS:
+                frame[name + '_ms'] = other.getDt() * 1000.0
+
+        self.last_spawned = scene.spawned
+        self.last_despawned = scene.despawned
+        self.frames.append(frame)
+        self.frame_count += 1
+
+        for name, collector in self.collectors.items():
+            if frame[name] is not None:
+                collector.setLevel(frame[name])
+        if self.text is not None and not self.text.isHidden():
+            self.text.setText(self.format(frame))
+        if self.log_path and self.frame_count % self.log_every == 0:
+            self.save(self.log_path)
+        return task.cont
+
+    def format(self, frame):
+        tasks = ['{} {:.2f}ms'.format(key[:-3], value) for key, value in frame.items()
+                 if key.endswith('_ms') and key != 'dt_ms']
+        return '\n'.join([
+            'frame {:.1f}ms'.format(frame['dt_ms']),
+            'objects {objects}  +{spawned} -{despawned}  lights {lights}'.format(**frame),
+            'object memory {object_vertices} vertices  {object_bytes} bytes'.format(**frame),
+            'scene nodes {nodes}  primitives {primitives}'.format(**frame),
+        ] + tasks)
+
+    def save(self, path):
+        """
+        Writes the frames in the history to path, as CSV if it ends in .csv and JSON otherwise.
+        """
+        frames = list(self.frames)
+        if path.endswith('.csv'):
+            # tasks can come and go, so the columns are the union over all frames
+            columns = []
+            for frame in frames:
+                columns += [key for key in frame if key not in columns]
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(frames)
+        else:
+            with open(path, 'w') as f:
+                json.dump(frames, f)
@@ -0,0 +1,70 @@
+import heapq
+
+
+class LightManager:
+    """
+    Owns the point lights of every emitter (stars, comets) and only enables the
+    max_lights most relevant ones on root, so lighting cost doesn't grow with the
+    number of spawned objects. Everything else just glows with its emission material.
+
+    Relevance is the light's brightness divided by its attenuation at the distance
+    from the camera, i.e. roughly how much it would light things near the viewer.
+    The brightness is taken when the light is registered, so lights that pulse
+    (see StarAnimator) don't get swapped in and out as they dim.
+    """
+
+    def __init__(self, root, max_lights=8):
+        self.root = root
+        self.max_lights = max_lights
+        self.emitters = []
+        self.brightness = {}
+        self.active = set()
+
+    def register(self, obj):
+        """
+        Takes over obj.light_node; the object stops enabling its own light.
+        """
+        obj.release_light()
+        self.emitters.append(obj)
+        color = obj.light_node.node().getColor()
+        self.brightness[obj.light_node] = max(color[0], color[1], color[2])
+
+    def unregister(self, obj):
+        self.emitters.remove(obj)
+        self.brightness.pop(obj.light_node, None)
+        if obj.light_node in self.active:
+            self.active.discard(obj.light_node)
+            self.root.clearLight(obj.light_node)
+
+    def relevance(self, light_np, camera):
+        light = light_np.node()
+        brightness = self.brightness[light_np]
+        c, l, q = light.getAttenuation()
+        distance = light_np.getPos(camera).length()
+        return brightness / max(c + l * distance + q * distance * distance, 1e-6)
+
+    def update(self, camera, candidates=None):
+        """
+        Re-ranks the emitters and switches lights on and off where the top K changed.
+        candidates narrows the ranking down to some of the registered emitters, like
+        the nearest ones from a SpatialIndex, instead of all of them.
+        """
+        emitters = self.emitters if candidates is None else candidates
+        lights = [obj.light_node for obj in emitters]
+        best = heapq.nlargest(self.max_lights, lights, key=lambda light_np: self.relevance(light_np, camera))
+        wanted = set(best)
+
+        for light_np in self.active - wanted:
+            self.root.clearLight(light_np)
+        for light_np in wanted - self.active:
+            self.root.setLight(light_np)
+        self.active = wanted
+
+    def is_active(self, obj):
+        return obj.light_node in self.active
+
+    def stats(self):
+        return {
+            'emitters': len(self.emitters),
+            'active': len(self.active),
+        }
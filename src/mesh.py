@@ -0,0 +1,262 @@
+from panda3d.core import (Geom, GeomEnums, GeomNode, GeomPoints, GeomTriangles, GeomVertexData,
+                          GeomVertexFormat, LODNode, NodePath, RenderModeAttrib)
+import numpy as np
+
+
+# Bulk geometry helpers -- instead of one GeomVertexWriter call per vertex, the
+# whole buffer is computed with numpy and copied straight into panda's memory.
+
+_NUMPY_TYPES = {
+    GeomEnums.NT_float32: np.float32,
+    GeomEnums.NT_uint8: np.uint8,
+    GeomEnums.NT_uint16: np.uint16,
+    GeomEnums.NT_uint32: np.uint32,
+    GeomEnums.NT_packed_dabc: np.uint32,
+}
+
+
+# Smallest vertex format each kind of geometry can be drawn with. Colors are always
+# 8 bit RGBA (c4 = uint8 x4, cp = one packed word), and only lit surfaces keep normals;
+# emissive points and flat rings don't need them, the default normal is (0, 0, 1) anyway
+VERTEX_FORMATS = {
+    'sphere': GeomVertexFormat.getV3n3c4(),  # lit, the normal is what makes it look round
+    'ring': GeomVertexFormat.getV3c4(),      # flat, normal would be (0, 0, 1) everywhere
+    'point': GeomVertexFormat.getV3c4(),     # single points (comet core, far sphere LOD)
+    'cloud': GeomVertexFormat.getV3cp(),     # nebulae and the star field
+    'spine': GeomVertexFormat.getV3(),       # GPU nebulae, the shader does the colors
+    'trail': GeomVertexFormat.getV3c4(),     # rewritten every frame, alpha is a byte
+}
+
+
+def vertex_format(kind):
+    """
+    Returns the vertex format to build `kind` geometry with, see VERTEX_FORMATS.
+    """
+    return VERTEX_FORMATS[kind]
+
+
+def pack_colors(colors):
+    """
+    Packs float RGBA colors (n x 4, 0..1) into 0xAARRGGBB words, the layout
+    panda uses for NT_packed_dabc color columns.
+    """
+    c = np.round(np.clip(colors, 0, 1) * 255).astype(np.uint32)
+    return (c[:, 3] << 24) | (c[:, 0] << 16) | (c[:, 1] << 8) | c[:, 2]
+
+
+def _column_values(column, values):
+    # Converts float input into whatever the column actually stores
+    numeric_type = column.getNumericType()
+    if numeric_type == GeomEnums.NT_packed_dabc:
+        if values.dtype == np.uint32:
+            return values  # already packed
+        return pack_colors(values)
+    if numeric_type == GeomEnums.NT_uint8 and column.getContents() == GeomEnums.C_color:
+        return np.round(np.clip(values, 0, 1) * 255)
+    return values
+
+
+def _row_dtype(array_format):
+    names, formats, offsets = [], [], []
+    for i in range(array_format.getNumColumns()):
+        column = array_format.getColumn(i)
+        if column.getNumericType() == GeomEnums.NT_packed_dabc:
+            shape = ()
+        else:
+            shape = (column.getNumComponents(),)
+        names.append(column.getName().getName())
+        formats.append((_NUMPY_TYPES[column.getNumericType()], shape))
+        offsets.append(column.getStart())
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                     'itemsize': array_format.getStride()})
+
+
+def fill_vertex_data(vdata, columns, start=0):
+    """
+    Replaces the contents of vdata with the given columns in one copy per array.
+    `columns` maps a column name ('vertex', 'normal', 'color', ...) to an array
+    with one row per vertex; columns that are left out are zeroed.
+    With a start row, the rows before it are kept and the columns are written
+    after them, which grows vdata a chunk at a time.
+    """
+    num_rows = len(next(iter(columns.values())))
+    if start:
+        vdata.setNumRows(start + num_rows)
+    else:
+        vdata.uncleanSetNumRows(num_rows)
+
+    format = vdata.getFormat()
+    for a in range(format.getNumArrays()):
+        array_format = format.getArray(a)
+        rows = np.zeros(num_rows, dtype=_row_dtype(array_format))
+        for i in range(array_format.getNumColumns()):
+            column = array_format.getColumn(i)
+            name = column.getName().getName()
+            if name in columns:
+                rows[name] = _column_values(column, columns[name])
+
+        handle = memoryview(vdata.modifyArray(a)).cast('B')
+        handle[start * array_format.getStride():] = rows.view(np.uint8).reshape(-1)
+
+
+def make_triangles(indices, usage=Geom.UHStatic):
+    """
+    Builds a GeomTriangles from a flat index array, using 16 bit indices
+    whenever the vertex count allows it.
+    """
+    indices = np.asarray(indices)
+    prim = GeomTriangles(usage)
+    if len(indices) and indices.max() < 0xffff:
+        prim.setIndexType(GeomEnums.NT_uint16)
+        indices = indices.astype(np.uint16)
+    else:
+        prim.setIndexType(GeomEnums.NT_uint32)
+        indices = indices.astype(np.uint32)
+
+    handle = prim.modifyVertices()
+    handle.uncleanSetNumRows(len(indices))
+    memoryview(handle).cast('B')[:] = indices.view(np.uint8)
+    return prim
+
+
+def sphere_arrays(num_segments):
+    """
+    Unit UV sphere as (positions, indices). Same vertex order and winding as the
+    old per-vertex loops: theta (around) is the outer index, phi (down) the inner.
+    Positions double as normals since the sphere is centered on the origin.
+    """
+    theta = np.linspace(0, 2 * np.pi, num_segments + 1)
+    phi = np.linspace(0, np.pi, num_segments + 1)
+    theta, phi = np.meshgrid(theta, phi, indexing='ij')
+
+    positions = np.stack((np.sin(phi) * np.cos(theta),
+                          np.sin(phi) * np.sin(theta),
+                          np.cos(phi)), axis=-1).reshape(-1, 3).astype(np.float32)
+
+    i, j = np.meshgrid(np.arange(num_segments), np.arange(num_segments), indexing='ij')
+    i0 = i * (num_segments + 1) + j
+    i1 = i0 + 1
+    i2 = i0 + num_segments + 1
+    i3 = i2 + 1
+    indices = np.stack((i0, i2, i1, i1, i2, i3), axis=-1).reshape(-1)
+
+    return positions, indices
+
+
+def make_sphere_geom(vdata, radius, num_segments, colors):
+    """
+    Fills vdata with a sphere of the given radius and per-vertex colors
+    (an (n, 4) array, see sphere_vertex_count) and returns the Geom.
+    """
+    positions, indices = sphere_arrays(num_segments)
+    fill_vertex_data(vdata, {
+        'vertex': positions * radius,
+        'normal': positions,
+        'color': colors,
+    })
+
+    geom = Geom(vdata)
+    geom.addPrimitive(make_triangles(indices, vdata.getUsageHint()))
+    return geom
+
+
+def sphere_vertex_count(num_segments):
+    return (num_segments + 1) ** 2
+
+
+# Unit spheres keyed by (num_segments, min_tint), shared by every Planet/Star
+_sphere_templates = {}
+
+
+def sphere_template(num_segments=32, min_tint=1.0):
+    """
+    Returns a shared unit sphere Geom. Bodies instance it under their own
+    GeomNode and apply radius with setScale and their base color with
+    setColorScale; the per-vertex colors are just a gray tint in
+    [min_tint, 1] per channel so the surface doesn't look flat.
+    """
+    key = (num_segments, min_tint)
+    geom = _sphere_templates.get(key)
+    if geom is None:
+        num_vertices = sphere_vertex_count(num_segments)
+        rng = np.random.default_rng(num_segments)  # same tint pattern every run
+        colors = np.ones((num_vertices, 4))
+        colors[:, :3] = rng.uniform(min_tint, 1.0, (num_vertices, 3))
+
+        vdata = GeomVertexData("sphere", vertex_format('sphere'), Geom.UHStatic)
+        geom = make_sphere_geom(vdata, 1.0, num_segments, colors)
+        _sphere_templates[key] = geom
+    return geom
+
+
+# Sphere detail levels as (segments, distance in radii where the level ends), nearest first.
+# Past the last one a body is drawn as a single point.
+SPHERE_LODS = ((64, 6), (32, 20), (16, 60), (8, 200), (4, 600))
+POINT_LOD_DISTANCE = 1e9
+
+# One GeomNode per level and tint, instanced under every body's LODNode
+_lod_levels = {}
+_point_templates = {}
+
+
+def point_template(min_tint=1.0):
+    """
+    A single point at the origin, the farthest detail level of a sphere.
+    """
+    geom = _point_templates.get(min_tint)
+    if geom is None:
+        vdata = GeomVertexData("point", vertex_format('point'), Geom.UHStatic)
+        fill_vertex_data(vdata, {
+            'vertex': np.zeros((1, 3)),
+            'color': np.ones((1, 4)) * ((1 + min_tint) / 2),  # average of the sphere tint
+        })
+        points = GeomPoints(Geom.UHStatic)
+        points.addVertex(0)
+        geom = Geom(vdata)
+        geom.addPrimitive(points)
+        _point_templates[min_tint] = geom
+    return geom
+
+
+def _sphere_lod_levels(min_tint):
+    levels = _lod_levels.get(min_tint)
+    if levels is None:
+        levels = []
+        for segments, _ in SPHERE_LODS:
+            node = GeomNode("sphere_{}".format(segments))
+            node.addGeom(sphere_template(segments, min_tint))
+            levels.append(NodePath(node))
+
+        node = GeomNode("sphere_point")
+        node.addGeom(point_template(min_tint))
+        point = NodePath(node)
+        # Instanced into every sphere, so it isn't anyone's memory (see eviction.geometry_size)
+        for level in levels + [point]:
+            level.setTag('shared', '1')
+        point.setRenderMode(RenderModeAttrib.MPoint, 2)
+        levels.append(point)
+        _lod_levels[min_tint] = levels
+    return levels
+
+
+def make_sphere_lod(name, radius, min_tint=1.0):
+    """
+    Unit sphere that switches tessellation with distance. Scale the returned node
+    by radius; the switch distances are in camera space, so they get multiplied by
+    radius here (and again by set_sphere_lod_radius() when the radius changes).
+    """
+    lod_np = NodePath(LODNode(name))
+    for level in _sphere_lod_levels(min_tint):
+        level.instanceTo(lod_np)
+        lod_np.node().addSwitch(0, 0)
+    set_sphere_lod_radius(lod_np, radius)
+    return lod_np
+
+
+def set_sphere_lod_radius(lod_np, radius):
+    lod = lod_np.node()
+    near = 0
+    for i, (_, far) in enumerate(SPHERE_LODS):
+        lod.setSwitch(i, far * radius, near * radius)
+        near = far
+    lod.setSwitch(len(SPHERE_LODS), POINT_LOD_DISTANCE, near * radius)
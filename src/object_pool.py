@@ -0,0 +1,49 @@
+class ObjectPool:
+    """
+    Per-kind free lists of despawned objects.
+
+    acquire() hands back a parked object reset() with the new parameters when one
+    is available and only constructs a new one otherwise; release() parks an object
+    with detach() so its nodes, vertex data, materials and lights get reused.
+    Each kind keeps at most max_free parked objects, anything beyond that is destroyed.
+    """
+
+    def __init__(self, types, max_free=16):
+        self.types = types
+        self.kinds = {cls: kind for kind, cls in types.items()}
+        self.max_free = max_free
+        self.free = {kind: [] for kind in types}
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, kind, params):
+        free = self.free[kind]
+        if free:
+            obj = free.pop()
+            obj.reset(**params)
+            self.reused += 1
+        else:
+            obj = self.types[kind](**params)
+            self.created += 1
+        return obj
+
+    def release(self, obj):
+        free = self.free[self.kinds[type(obj)]]
+        if len(free) < self.max_free:
+            obj.detach()
+            free.append(obj)
+        else:
+            obj.destroy()
+
+    def clear(self):
+        for free in self.free.values():
+            for obj in free:
+                obj.destroy()
+            free.clear()
+
+    def stats(self):
+        return {
+            'created': self.created,
+            'reused': self.reused,
+            'free': {kind: len(free) for kind, free in self.free.items()},
+        }
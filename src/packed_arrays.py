@@ -0,0 +1,39 @@
+import numpy as np
+
+
+class PackedArrays:
+    """
+    numpy arrays with one row per item, kept dense by moving the last item into a
+    removed one's slot. The arrays are attributes named after the keyword arguments.
+    """
+
+    def __init__(self, **arrays):
+        self.items = []
+        self.slots = {}
+        self.names = list(arrays)
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item, **row):
+        self.slots[item] = len(self.items)
+        self.items.append(item)
+        for name in self.names:
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.asarray(row[name], dtype=array.dtype)[None]]))
+
+    def remove(self, item):
+        slot = self.slots.pop(item)
+        last = len(self.items) - 1
+        if slot != last:
+            moved = self.items[last]
+            self.items[slot] = moved
+            self.slots[moved] = slot
+            for name in self.names:
+                array = getattr(self, name)
+                array[slot] = array[last]
+        self.items.pop()
+        for name in self.names:
+            setattr(self, name, getattr(self, name)[:last])
@@ -1,43 +1,146 @@
 from direct.showbase.ShowBase import ShowBase
-from panda3d.core import WindowProperties, Vec3
+from panda3d.core import WindowProperties, GraphicsWindow, Camera
 from direct.task import Task
+import os
 import sys
-import random
-import math
 
 from Comet import Comet
-from Nebula import Nebula
+from Nebula import Nebula, gpu_nebula_supported
 from Planet import Planet
 from Star import Star
+from sector_streaming import DEFAULT_DENSITY, SectorStreamer
+from eviction import Evictor
+from object_pool import ObjectPool
+from generation_pipeline import GenerationPipeline
+from spawn_scheduler import SpawnScheduler
+from light_manager import LightManager
+from star_field import StarField
+from comet_system import CometSystem
+from static_batching import StaticBatcher
+from instrumentation import Instrumentation
+from seeding import SeedContext, object_seed
+from geometry_cache import GeometryCache
+from impostors import ImpostorManager
+from region_culling import RegionCuller
+from star_animation import StarAnimator
+from spatial_index import SpatialIndex
+
+
+# Constructors for the object kinds that sectors can contain
+OBJECT_TYPES = {
+    'comet': Comet,
+    'nebula': Nebula,
+    'planet': Planet,
+    'star': Star,
+}
+
+# Heavy numpy work that can run off the main thread, per kind
+PREBUILDERS = {
+    'nebula': Nebula.prebuild,
+}
+
+# Prebuilt geometry is kept here between runs, see GeometryCache
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'making_space', 'geometry')
 
 
 class SpaceScene(ShowBase):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, world_seed=None, sector_size=600.0, sector_radius=2, density=DEFAULT_DENSITY,
+                 spawn_budget_ms=4.0, max_lights=8, window_type=None, stats_log=None, show_stats=False,
+                 cache_dir=DEFAULT_CACHE_DIR, gpu_nebulae=None, impostor_distance=800.0):
+        super().__init__(windowType=window_type)
+
+        # Without a real window (window-type none/offscreen, see benchmark.py) there's no
+        # mouse to grab, and with none there isn't even a default camera
+        self.headless = not isinstance(self.win, GraphicsWindow)
+        if self.camera is None:
+            self.camera = self.render.attachNewNode('camera')
+            self.cam = self.camera.attachNewNode(Camera('cam'))
+            self.camLens = self.cam.node().getLens()
+
+        # Nebulae expanded from their arm spines by a shader (see Nebula), when the
+        # driver can run it. None picks it automatically
+        if gpu_nebulae is None:
+            gpu_nebulae = gpu_nebula_supported()
+        self.gpu_nebulae = gpu_nebulae
 
         self.procedural_objects = []
+        self.spawned = 0
+        self.despawned = 0
+        self.pool = ObjectPool(OBJECT_TYPES)
+
+        # Geometry is built on worker threads (or loaded from the cache when it was built
+        # before), the task below only attaches finished objects and only as many as fit
+        # in the scheduler's per-frame budget. cache_dir=None turns the cache off
+        self.prebuilders = dict(PREBUILDERS)
+        self.geometry_cache = None
+        if cache_dir is not None:
+            self.geometry_cache = GeometryCache(cache_dir)
+            self.prebuilders = {kind: self.geometry_cache.cached(kind, prebuild)
+                                for kind, prebuild in PREBUILDERS.items()}
+        self.pipeline = GenerationPipeline(self.prebuilders)
+        self.scheduler = SpawnScheduler(budget_ms=spawn_budget_ms)
+
+        # Same seed -> same universe, bit for bit; every random number comes from a stream of it
+        self.seeds = SeedContext(world_seed)
+        self.world_seed = self.seeds.seed
+        # Sectors hang off region nodes, and whole regions and sectors out of view are
+        # stashed so culling never visits their objects
+        self.culler = RegionCuller(self.render, sector_size)
+        self.streamer = SectorStreamer(self.render, self.request_spawn, self.despawn, self.seeds,
+                                       self.pipeline.cancel, sector_size=sector_size, radius=sector_radius,
+                                       density=density, extent=self.object_extent, culler=self.culler)
+
+        # Where everything is, for overlap checks and nearest-object queries
+        self.index = SpatialIndex(cell_size=sector_size)
+
+        # Only the few most relevant star/comet lights are on at any time
+        self.lights = LightManager(self.render, max_lights=max_lights)
+        # and only those lights pulse, all stars in one pass
+        self.star_animator = StarAnimator(self.lights)
+
+        # Background sky, with the nearest few stars promoted to full Star objects
+        self.star_field = StarField(self.seeds, self.promote_star, self.demote_star)
+        self.star_field.node.reparentTo(self.render)
+
+        # Every comet is moved by one vectorized step per frame
+        self.comets = CometSystem(self.render, index=self.index)
+
+        # Nebulae and rings of each sector are flattened into a few static Geoms
+        self.batcher = StaticBatcher()
+
+        # Far away planets and nebulae are drawn as cards from a shared texture atlas.
+        # impostor_distance=None keeps the real geometry at any distance
+        self.impostors = None
+        if impostor_distance is not None:
+            self.impostors = ImpostorManager(self.render, distance=impostor_distance, batcher=self.batcher)
+
+        # Hard limits on top of the sector radius, for long sessions in dense regions
+        self.evictor = Evictor(max_objects=400, max_vertices=2000000, max_bytes=64 * 1024 * 1024,
+                               max_hidden_time=60, batcher=self.batcher)
 
         self.disableMouse()
 
-        properties = WindowProperties()
-        properties.setCursorHidden(True)
-        properties.setMouseMode(WindowProperties.M_confined)
-        self.win.requestProperties(properties)
+        if not self.headless:
+            properties = WindowProperties()
+            properties.setCursorHidden(True)
+            properties.setMouseMode(WindowProperties.M_confined)
+            self.win.requestProperties(properties)
 
-        w, h = 1664, 936
+            w, h = 1664, 936
 
-        props = WindowProperties() 
-        props.setSize(w, h) 
+            props = WindowProperties() 
+            props.setSize(w, h) 
 
-        self.win.requestProperties(props)
+            self.win.requestProperties(props)
 
         self.camera.setPos(0, 0, 0)
         self.camera.setHpr(0, 0, 0)
 
         self.movement_speed = 50
         self.mouse_sensitivity = 0.1
-        self.win.movePointer(0, self.win.getXSize() // 2, self.win.getYSize() // 2)
+        if not self.headless:
+            self.win.movePointer(0, self.win.getXSize() // 2, self.win.getYSize() // 2)
         
         self.key_map = {
             "forward": False,
@@ -63,46 +166,124 @@ class SpaceScene(ShowBase):
         self.accept("escape", sys.exit)
 
         self.taskMgr.add(self.move, "moveTask")
-        self.taskMgr.add(self.mouse_look, "mouseLookTask")
+        if not self.headless:
+            self.taskMgr.add(self.mouse_look, "mouseLookTask")
 
         self.setup_scene()
 
         self.taskMgr.add(self.procedural_generation, "procedural_generation")
+        self.taskMgr.add(self.update_comets, "update_comets")
+        self.taskMgr.add(self.animate_stars, "animate_stars", sort=1)
+
+        # Frame stats for finding stutters, F3 shows them on screen
+        self.instrumentation = Instrumentation(self, log_path=stats_log, overlay=show_stats)
+        self.accept("f3", self.instrumentation.toggle_overlay)
 
     def update_key_map(self, control_name, is_down):
         self.key_map[control_name] = is_down
 
 
     def procedural_generation(self, task):
-        if self.should_add_object():
-            object_type = random.choice(['comet', 'nebula', 'planet', 'star'])
-            position = self.random_position_around_camera(distance=500)
-            
-            if object_type == 'comet':
-                comet = Comet(radius=random.uniform(4, 15), pos=position, velocity=(random.uniform(1, 5.0), 0, random.uniform(1, 5.0)))
-                comet.node.reparentTo(self.render)
-                self.procedural_objects.append(comet)
-            
-            elif object_type == 'nebula':
-                nebula = Nebula(scale=random.uniform(0.5, 4.0), pos=position,
-                                num_arms=random.randint(2, 5), points_per_arm=random.randint(200, 2000),
-                                thickness=random.uniform(0.1, 1))
-                nebula.node.reparentTo(self.render)
-                self.procedural_objects.append(nebula)
-            
-            elif object_type == 'planet':
-                planet = Planet(radius=random.uniform(100.0, 5.0), pos=position,
-                                 has_rings=random.random() < 0.2, ring_color=(1, 0.9, 0.8, 0.3))
-                planet.node.reparentTo(self.render)
-                self.procedural_objects.append(planet)
-            
-            elif object_type == 'star':
-                star = Star(radius=random.uniform(0.5, 1.5), pos=position)
-                star.node.reparentTo(self.render)
-                self.procedural_objects.append(star)
-        
+        # Load the sectors around the camera and free the ones it left behind
+        self.streamer.update(self.camera.getPos(self.render))
+        self.culler.update(self.cam, self.camLens)
+
+        self.scheduler.run(self.pipeline, self.attach)
+
+        for obj in self.evictor.update(self.cam, self.camLens, globalClock.getFrameTime()):
+            self.despawn(obj)
+
+        # Rebuilding batches shares the spawn budget
+        self.batcher.update(self.scheduler.remaining_ms())
+        if self.impostors is not None:
+            self.impostors.update(self.camera)
+        camera_pos = self.camera.getPos(self.render)
+        self.star_field.update(camera_pos)
+        # Only the nearest few emitters are worth ranking
+        emitters = self.index.nearest(camera_pos, 4 * self.lights.max_lights,
+                                      where=lambda obj: hasattr(obj, 'light_node'))
+        self.lights.update(self.cam, emitters)
+        return task.cont
+
+    def update_comets(self, task):
+        self.comets.update(globalClock.getDt())
+        return task.cont
+
+    def animate_stars(self, task):
+        # After procedural_generation, which picks the lights worth animating
+        self.star_animator.update(task.time, self.cam, self.camLens, self.render)
         return task.cont
 
+    def object_extent(self, kind, params):
+        return OBJECT_TYPES[kind].extent(**params)
+
+    def request_spawn(self, kind, params, sector):
+        if kind == 'nebula' and self.gpu_nebulae:
+            params = dict(params, gpu=True)
+        self.pipeline.submit(kind, params, sector)
+
+    def attach(self, kind, params, sector):
+        obj = self.spawn(kind, params)
+        self.streamer.add(sector, obj)
+        if isinstance(obj, Comet):
+            # comets fly out of their sector's box, so they aren't culled with it
+            obj.node.reparentTo(self.render)
+        if hasattr(obj, 'static_geometry'):
+            self.batcher.add(sector, obj)
+        return obj
+
+    def spawn(self, kind, params):
+        obj = self.pool.acquire(kind, params)
+        self.procedural_objects.append(obj)
+        self.index.insert(obj, params['pos'], self.object_extent(kind, params))
+        self.spawned += 1
+        self.evictor.track(obj, globalClock.getFrameTime())
+        if hasattr(obj, 'light_node'):
+            self.lights.register(obj)
+        if isinstance(obj, Comet):
+            self.comets.add(obj)
+        if isinstance(obj, Star):
+            self.star_animator.add(obj)
+        if self.impostors is not None and isinstance(obj, (Planet, Nebula)):
+            self.impostors.add(obj, additive=isinstance(obj, Nebula))
+        return obj
+
+    def despawn(self, obj):
+        self.procedural_objects.remove(obj)
+        self.despawned += 1
+        self.index.remove(obj)
+        self.evictor.forget(obj)
+        self.scheduler.forget(obj)
+        if hasattr(obj, 'light_node'):
+            self.lights.unregister(obj)
+        if isinstance(obj, Comet):
+            self.comets.remove(obj)
+        if isinstance(obj, Star):
+            self.star_animator.remove(obj)
+        if self.impostors is not None:
+            self.impostors.remove(obj)
+        self.batcher.remove(obj)
+        self.streamer.release(obj)
+        self.pool.release(obj)
+
+    def promote_star(self, pos, seed):
+        params = dict(pos=pos, seed=seed)
+        star = self.pool.acquire('star', params)
+        star.node.reparentTo(self.render)
+        self.lights.register(star)
+        self.star_animator.add(star)
+        self.index.insert(star, pos, self.object_extent('star', params))
+        return star
+
+    def demote_star(self, star):
+        self.star_animator.remove(star)
+        self.index.remove(star)
+        self.lights.unregister(star)
+        self.pool.release(star)
+
+    def eviction_stats(self):
+        return self.evictor.stats()
+
     def move(self, task):
         dt = globalClock.getDt()
         if self.key_map["forward"]:
@@ -128,44 +309,32 @@ class SpaceScene(ShowBase):
             self.camera.setP(self.camera.getP() - (y - self.win.getYSize() // 2) * self.mouse_sensitivity)
         return Task.cont
 
-    def should_add_object(self):
-        # Logic to decide if a new object should be added
-        # This could be based on time, distance traveled, or number of objects currently in the scene
-        return random.random() < 0.04
-
-
-    def random_position_around_camera(self, distance):
-        # Generate a random position around the camera within the given distance
-        angle = random.uniform(0, 2 * math.pi)
-        x = self.camera.getX() + distance * math.cos(angle)
-        y = self.camera.getY() + distance * math.sin(angle)
-        z = random.uniform(-distance / 2, distance / 2)  # some variation in the z-axis
-        return (x, y, z)
-
-    def random_velocity(self):
+    def random_velocity(self, rng):
         # Generate a random velocity vector
-        return (random.uniform(-0.1, 0.1), random.uniform(-0.1, 0.1), random.uniform(-0.1, 0.1))
+        return tuple(float(v) for v in rng.uniform(-0.1, 0.1, 3))
 
 
     def setup_scene(self):
         # Procedurally generate the space scene
+        rng = self.seeds.stream('setup')
         for _ in range(5):
-            x, y, z = [random.uniform(-100, 100) for _ in range(3)]
-            planet = Planet(random.uniform(0.5, 2.5), pos=(x, y, z))
+            x, y, z = (float(c) for c in rng.uniform(-100, 100, 3))
+            planet = Planet(float(rng.uniform(0.5, 2.5)), pos=(x, y, z), seed=object_seed(rng))
             planet.node.reparentTo(self.render)
 
-        # Generate some stars
-        for _ in range(20):  # Generate 20 random stars
-            x, y, z = [random.uniform(-100, 100) for _ in range(3)]
-            star = Star(pos=(x, y, z))
-            star.node.reparentTo(self.render)
+        # Stars come from the star field now, see StarField
 
         # Generate a comet
-        comet = Comet(radius=0.1, pos=(10, 20, -10), velocity=(-0.05, 0, 0))
+        comet = Comet(radius=0.1, pos=(10, 20, -10), velocity=(-0.05, 0, 0), seed=object_seed(rng))
         comet.node.reparentTo(self.render)
+        self.lights.register(comet)
+        self.index.insert(comet, comet.position, Comet.extent(radius=comet.radius))
+        self.comets.add(comet)
 
         # Generate a nebula
-        nebula = Nebula(scale=5, pos=(0, 0, 0), num_arms=3, points_per_arm=100, thickness=0.5)
+        params = dict(scale=5, pos=(0, 0, 0), num_arms=3, points_per_arm=100, thickness=0.5,
+                      seed=object_seed(rng), gpu=self.gpu_nebulae)
+        nebula = Nebula(**params, **self.prebuilders['nebula'](**params))
         nebula.node.reparentTo(self.render)
 
     
@@ -0,0 +1,111 @@
+from panda3d.core import BoundingBox, BoundingVolume, Point3
+
+
+class Region:
+
+    def __init__(self, key, node):
+        self.key = key
+        self.node = node
+        self.sectors = []
+        self.bounds = None
+
+
+class RegionCuller:
+    """
+    Groups sector nodes under region nodes (region_size sectors along each axis) and
+    stashes whole regions and sectors that are out of view or further than
+    max_distance, so the cull traversal doesn't even visit the objects in them and
+    its cost stays about the same however much is loaded off-screen.
+
+    The tests use precomputed boxes, not Panda's bounds: a sector's box is set once
+    when it's loaded (see SectorStreamer.load) and a region's is the union of its
+    sectors'. They are also given to the nodes with setBounds, so Panda's own test
+    of a region or sector is just as cheap.
+    """
+
+    def __init__(self, root, sector_size, region_size=4, max_distance=None):
+        self.root = root
+        self.sector_size = sector_size
+        self.region_size = region_size
+        self.max_distance = max_distance
+        self.regions = {}
+        self.stashed = 0
+
+    def region_of(self, key):
+        return tuple(k // self.region_size for k in key)
+
+    def parent_for(self, key):
+        """
+        Node the sector with this key should be attached to, made if needed.
+        """
+        region_key = self.region_of(key)
+        region = self.regions.get(region_key)
+        if region is None:
+            region = Region(region_key, self.root.attachNewNode("region_{}_{}_{}".format(*region_key)))
+            self.regions[region_key] = region
+        return region.node
+
+    def add_sector(self, sector):
+        region = self.regions[self.region_of(sector.key)]
+        region.sectors.append(sector)
+        sector.node.node().setBounds(sector.bounds)
+        self.update_bounds(region)
+
+    def remove_sector(self, sector):
+        region = self.regions[self.region_of(sector.key)]
+        region.sectors.remove(sector)
+        if not region.sectors:
+            region.node.removeNode()
+            del self.regions[region.key]
+        else:
+            self.update_bounds(region)
+
+    def update_bounds(self, region):
+        low = [min(sector.bounds.getMin()[i] for sector in region.sectors) for i in range(3)]
+        high = [max(sector.bounds.getMax()[i] for sector in region.sectors) for i in range(3)]
+        region.bounds = BoundingBox(Point3(*low), Point3(*high))
+        region.node.node().setBounds(region.bounds)
+
+    def visible(self, bounds, frustum, camera_pos):
+        if self.max_distance is not None:
+            # distance from the camera to the closest point of the box
+            low, high = bounds.getMin(), bounds.getMax()
+            gap = [max(low[i] - camera_pos[i], 0, camera_pos[i] - high[i]) for i in range(3)]
+            if gap[0] ** 2 + gap[1] ** 2 + gap[2] ** 2 > self.max_distance ** 2:
+                return False
+        return frustum.contains(bounds) != BoundingVolume.IF_no_intersection
+
+    def update(self, camera, lens):
+        """
+        Stashes and unstashes regions, then the sectors of the regions left in view.
+        """
+        frustum = lens.makeBounds()
+        frustum.xform(camera.getMat(self.root))
+        camera_pos = camera.getPos(self.root)
+
+        stashed = 0
+        for region in self.regions.values():
+            if not self.visible(region.bounds, frustum, camera_pos):
+                if not region.node.isStashed():
+                    region.node.stash()
+                stashed += len(region.sectors)
+                continue
+            if region.node.isStashed():
+                region.node.unstash()
+            for sector in region.sectors:
+                if self.visible(sector.bounds, frustum, camera_pos):
+                    if sector.node.isStashed():
+                        sector.node.unstash()
+                elif not sector.node.isStashed():
+                    sector.node.stash()
+                    stashed += 1
+                else:
+                    stashed += 1
+        self.stashed = stashed
+
+    def stats(self):
+        return {
+            'regions': len(self.regions),
+            'sectors': sum(len(region.sectors) for region in self.regions.values()),
+            'stashed_sectors': self.stashed,
+        }
@@ -0,0 +1,250 @@
+import math
+
+from panda3d.core import BoundingBox, Point3
+
+from Planet import generate_planet_color
+from seeding import object_seed
+from spatial_index import SpatialIndex
+
+
+# Space is split into cubic sectors. What a sector contains only depends on the world
+# seed and its coordinates, so sectors can be freed when the camera leaves and rebuilt
+# identically when it comes back.
+
+def sector_of(pos, sector_size):
+    """
+    Returns the (x, y, z) key of the sector containing pos.
+    """
+    return tuple(int(math.floor(c / sector_size)) for c in pos)
+
+
+def sector_rng(seeds, key):
+    """
+    numpy Generator for one sector, from the universe's SeedContext. Stable between
+    runs and machines.
+    """
+    return seeds.stream('sector', *key)
+
+
+# Objects per cubic unit of space, about 2 per 600 unit sector
+DEFAULT_DENSITY = 2 / 600.0 ** 3
+
+
+def sector_contents(rng, key, sector_size, density=DEFAULT_DENSITY, extent=None):
+    """
+    Decides what goes in a sector as a list of (kind, params) pairs, where params are
+    the keyword arguments for that kind's constructor.
+    The number of objects follows the density per unit of volume, so flying through
+    space spawns at the same rate per distance no matter the frame rate or sector size.
+    Uses the same parameter ranges the old per-frame random spawning did.
+    With extent(kind, params) giving the radius an object takes up, objects that
+    would overlap one placed before them in the sector are dropped.
+    """
+    contents = []
+    placed = SpatialIndex(cell_size=sector_size / 4)
+    for _ in range(rng.poisson(density * sector_size ** 3)):
+        pos = tuple(float(k + rng.random()) * sector_size for k in key)
+        object_type = ('comet', 'nebula', 'planet', 'star')[rng.integers(4)]
+
+        if object_type == 'comet':
+            params = dict(radius=float(rng.uniform(4, 15)), pos=pos,
+                          velocity=(float(rng.uniform(1, 5.0)), 0, float(rng.uniform(1, 5.0))))
+        elif object_type == 'nebula':
+            params = dict(scale=float(rng.uniform(0.5, 4.0)), pos=pos,
+                          num_arms=int(rng.integers(2, 6)), points_per_arm=int(rng.integers(200, 2001)),
+                          thickness=float(rng.uniform(0.1, 1)))
+        elif object_type == 'planet':
+            params = dict(radius=float(rng.uniform(5.0, 100.0)), pos=pos,
+                          has_rings=bool(rng.random() < 0.2), ring_color=(1, 0.9, 0.8, 0.3),
+                          base_color=generate_planet_color(rng))
+        else:
+            params = dict(radius=float(rng.uniform(0.5, 1.5)), pos=pos)
+
+        # Anything random inside the object (jitter, tints) comes from its own stream
+        params['seed'] = object_seed(rng)
+
+        # Still drawn from rng above when dropped, so the rest of the sector stays the same
+        if extent is not None:
+            radius = extent(object_type, params)
+            if placed.overlaps(pos, radius):
+                continue
+            placed.insert(len(contents), pos, radius)
+        contents.append((object_type, params))
+    return contents
+
+
+def neighbours(key):
+    """
+    Keys of the 26 sectors around key.
+    """
+    return [(key[0] + dx, key[1] + dy, key[2] + dz)
+            for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1) if dx or dy or dz]
+
+
+def resolve_overlaps(key, contents, planned, extent):
+    """
+    Drops the objects of the sector at key that touch an object of a neighbour with
+    a lower key. planned is a SpatialIndex of what those neighbours would contain, as
+    (sector key, index in its sector_contents), so a sector comes out the same
+    whatever is loaded around it. Objects are assumed to be smaller than half a
+    sector, so only the sectors right next to it are checked.
+    """
+    rivals = set(other for other in neighbours(key) if other < key)
+    kept = []
+    for kind, params in contents:
+        hits = planned.query_radius(params['pos'], extent(kind, params))
+        if not any(other_key in rivals for other_key, _ in hits):
+            kept.append((kind, params))
+    return kept
+
+
+def sector_bounds(key, sector_size, contents, extent=None):
+    """
+    Box around a sector and everything in it, as objects near the faces stick out.
+    """
+    low = [k * sector_size for k in key]
+    high = [(k + 1) * sector_size for k in key]
+    for kind, params in contents:
+        radius = extent(kind, params) if extent is not None else 0.0
+        for i in range(3):
+            low[i] = min(low[i], params['pos'][i] - radius)
+            high[i] = max(high[i], params['pos'][i] + radius)
+    return BoundingBox(Point3(*low), Point3(*high))
+
+
+class Sector:
+
+    def __init__(self, key, parent):
+        self.key = key
+        self.node = parent.attachNewNode("sector_{}_{}_{}".format(*key))
+        self.objects = []
+        self.loaded = True
+        self.bounds = None
+
+
+class SectorStreamer:
+    """
+    Keeps the sectors within `radius` sectors of the camera loaded.
+
+    spawn(kind, params, sector) requests an object, which may be built later (on a
+    worker thread for example) and must then be handed to add(sector, obj).
+    despawn(obj) must free an object and call release(obj), and cancel(sector), if
+    given, drops requests that haven't been added yet when a sector is unloaded.
+    extent(kind, params), if given, keeps objects from overlapping, within a sector
+    (see sector_contents) and across neighbouring ones (see resolve_overlaps). The
+    neighbours' contents are only planned for that, not loaded. With a RegionCuller, sectors are attached under its
+    regions instead of parent. The streamer itself only deals with sector bookkeeping.
+    """
+
+    def __init__(self, parent, spawn, despawn, seeds, cancel=None, sector_size=600.0,
+                 radius=2, density=DEFAULT_DENSITY, extent=None, culler=None):
+        self.parent = parent
+        self.culler = culler
+        self.spawn = spawn
+        self.despawn = despawn
+        self.cancel = cancel
+        self.seeds = seeds
+        self.sector_size = sector_size
+        self.radius = radius
+        self.density = density
+        self.extent = extent
+        self.sectors = {}
+        self.object_sectors = {}
+        self.plans = {}  # sector_contents of sectors around the loaded ones
+        self.planned = SpatialIndex(cell_size=sector_size)  # and where their objects are
+        self.dropped = 0
+        self.center = None
+
+    def sectors_around(self, center):
+        r = self.radius
+        keys = set()
+        for dx in range(-r, r + 1):
+            for dy in range(-r, r + 1):
+                for dz in range(-r, r + 1):
+                    if dx * dx + dy * dy + dz * dz <= r * r:
+                        keys.add((center[0] + dx, center[1] + dy, center[2] + dz))
+        return keys
+
+    def update(self, pos):
+        """
+        Loads and unloads sectors for a camera at pos. Cheap when the camera
+        hasn't changed sector since the last call.
+        """
+        center = sector_of(pos, self.sector_size)
+        if center == self.center:
+            return
+        self.center = center
+        # plans of sectors that can't be loaded or next to a loaded one anymore
+        for key in [key for key in self.plans
+                    if max(abs(a - b) for a, b in zip(key, center)) > self.radius + 1]:
+            for i in range(len(self.plans.pop(key))):
+                self.planned.remove((key, i))
+
+        wanted = self.sectors_around(center)
+        for key in [key for key in self.sectors if key not in wanted]:
+            self.unload(key)
+        # nearest first so the sector the camera is in fills in before the edges
+        for key in sorted(wanted - self.sectors.keys(),
+                          key=lambda k: sum((a - b) ** 2 for a, b in zip(k, center))):
+            self.load(key)
+
+    def load(self, key):
+        parent = self.parent if self.culler is None else self.culler.parent_for(key)
+        sector = Sector(key, parent)
+        self.sectors[key] = sector
+        contents = self.plan(key)
+        if self.extent is not None:
+            planned = len(contents)
+            # only the neighbours that win against this sector matter
+            for other in neighbours(key):
+                if other < key:
+                    self.plan(other)
+            contents = resolve_overlaps(key, contents, self.planned, self.extent)
+            self.dropped += planned - len(contents)
+        sector.bounds = sector_bounds(key, self.sector_size, contents, self.extent)
+        if self.culler is not None:
+            self.culler.add_sector(sector)
+        for kind, params in contents:
+            self.spawn(kind, params, sector)
+        return sector
+
+    def plan(self, key):
+        contents = self.plans.get(key)
+        if contents is None:
+            contents = sector_contents(sector_rng(self.seeds, key), key, self.sector_size, self.density, self.extent)
+            self.plans[key] = contents
+            if self.extent is not None:
+                for i, (kind, params) in enumerate(contents):
+                    self.planned.insert((key, i), params['pos'], self.extent(kind, params))
+        return contents
+
+    def add(self, sector, obj):
+        obj.node.reparentTo(sector.node)
+        sector.objects.append(obj)
+        self.object_sectors[obj] = sector
+
+    def unload(self, key):
+        sector = self.sectors.pop(key)
+        sector.loaded = False
+        if self.cancel is not None:
+            self.cancel(sector)
+        for obj in list(sector.objects):
+            self.despawn(obj)
+        if self.culler is not None:
+            self.culler.remove_sector(sector)
+        sector.node.removeNode()
+
+    def release(self, obj):
+        """
+        Forgets an object that was despawned, either by unload() or by something
+        else like the evictor. It comes back the next time its sector is loaded.
+        """
+        sector = self.object_sectors.pop(obj, None)
+        if sector is not None:
+            sector.objects.remove(obj)
+
+    def unload_all(self):
+        for key in list(self.sectors):
+            self.unload(key)
+        self.center = None
+
@@ -0,0 +1,43 @@
+import zlib
+
+import numpy as np
+
+
+def key_words(key):
+    """
+    Turns a stream key (ints and strings) into the non-negative ints SeedSequence wants.
+    Strings go through crc32 so they hash the same in every run, unlike hash().
+    """
+    words = []
+    for part in key:
+        if isinstance(part, str):
+            words.append(zlib.crc32(part.encode()))
+        else:
+            words.append(int(part) % 2 ** 64)
+    return words
+
+
+class SeedContext:
+    """
+    Every random number in a universe comes from here. stream(*key) gives an
+    independent numpy Generator for a key like ('sector', x, y, z), the same one
+    every time for the same seed and key, whatever order they're asked for in.
+
+    Objects get their own stream from an int seed drawn from their sector's stream
+    (see sector_contents), so one object can be rebuilt without the rest.
+    """
+
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = int(seed) % 2 ** 128
+
+    def stream(self, *key):
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=key_words(key)))
+
+
+def object_seed(rng):
+    """
+    Draws the seed= param for one object from a parent stream.
+    """
+    return int(rng.integers(2 ** 63))
@@ -0,0 +1,150 @@
+import heapq
+import math
+
+
+class SpatialIndex:
+    """
+    Uniform hash grid over the live objects, each stored as a sphere (center, radius)
+    in the cell of its center. Queries only look at the cells around the query point,
+    widened by the largest radius seen, so they cost the same however many objects
+    are elsewhere in the universe.
+
+    Objects are anything hashable; the index doesn't look at them.
+    """
+
+    def __init__(self, cell_size=600.0):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entries = {}  # obj -> (pos, radius, cell)
+        self.max_radius = 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, obj):
+        return obj in self.entries
+
+    def cell_of(self, pos):
+        return (int(math.floor(pos[0] / self.cell_size)), int(math.floor(pos[1] / self.cell_size)),
+                int(math.floor(pos[2] / self.cell_size)))
+
+    def insert(self, obj, pos, radius=0.0):
+        pos = (float(pos[0]), float(pos[1]), float(pos[2]))
+        cell = self.cell_of(pos)
+        self.entries[obj] = (pos, radius, cell)
+        self.cells.setdefault(cell, set()).add(obj)
+        self.max_radius = max(self.max_radius, radius)
+
+    def remove(self, obj):
+        entry = self.entries.pop(obj, None)
+        if entry is None:
+            return
+        cell = entry[2]
+        members = self.cells[cell]
+        members.discard(obj)
+        if not members:
+            del self.cells[cell]
+
+    def move(self, obj, pos):
+        _, radius, cell = self.entries[obj]
+        pos = (float(pos[0]), float(pos[1]), float(pos[2]))
+        new_cell = self.cell_of(pos)
+        if new_cell != cell:
+            members = self.cells[cell]
+            members.discard(obj)
+            if not members:
+                del self.cells[cell]
+            self.cells.setdefault(new_cell, set()).add(obj)
+        self.entries[obj] = (pos, radius, new_cell)
+
+    def cells_within(self, pos, distance):
+        low = self.cell_of([c - distance for c in pos])
+        high = self.cell_of([c + distance for c in pos])
+        for x in range(low[0], high[0] + 1):
+            for y in range(low[1], high[1] + 1):
+                for z in range(low[2], high[2] + 1):
+                    members = self.cells.get((x, y, z))
+                    if members:
+                        yield members
+
+    def query_radius(self, pos, radius):
+        """
+        Returns the objects whose sphere touches the sphere at pos with this radius.
+        """
+        found = []
+        for members in self.cells_within(pos, radius + self.max_radius):
+            for obj in members:
+                center, obj_radius, _ = self.entries[obj]
+                if math.dist(pos, center) <= radius + obj_radius:
+                    found.append(obj)
+        return found
+
+    def overlaps(self, pos, radius, margin=0.0):
+        """
+        True if a sphere at pos would touch any object, with margin of free space between them.
+        """
+        for members in self.cells_within(pos, radius + margin + self.max_radius):
+            for obj in members:
+                center, obj_radius, _ = self.entries[obj]
+                if math.dist(pos, center) < radius + obj_radius + margin:
+                    return True
+        return False
+
+    def nearest(self, pos, k, where=None):
+        """
+        Returns up to k objects with the closest centers to pos, nearest first,
+        optionally only the ones where(obj) is true for. Searches shells of cells
+        outwards until nothing unvisited can be closer than the k found so far.
+        """
+        center_cell = self.cell_of(pos)
+        best = []  # max-heap of (-distance, id, obj)
+        seen = 0
+        ring = 0
+        while seen < len(self.entries):
+            if (2 * ring + 1) ** 3 > 8 * len(self.cells):
+                # the remaining objects are few and far apart, cheaper to just check them all
+                return self.nearest_brute_force(pos, k, where)
+            for cell in self.shell(center_cell, ring):
+                members = self.cells.get(cell)
+                if not members:
+                    continue
+                seen += len(members)
+                for obj in members:
+                    if where is not None and not where(obj):
+                        continue
+                    distance = math.dist(pos, self.entries[obj][0])
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, id(obj), obj))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, id(obj), obj))
+            # every cell outside this shell is at least ring * cell_size away
+            if len(best) == k and -best[0][0] <= ring * self.cell_size:
+                break
+            ring += 1
+        return [obj for _, _, obj in sorted(best, key=lambda item: -item[0])]
+
+    def nearest_brute_force(self, pos, k, where=None):
+        candidates = (obj for obj in self.entries if where is None or where(obj))
+        return heapq.nsmallest(k, candidates, key=lambda obj: math.dist(pos, self.entries[obj][0]))
+
+    def shell(self, center, ring):
+        # cells at exactly Chebyshev distance ring from center
+        if ring == 0:
+            yield center
+            return
+        cx, cy, cz = center
+        for x in range(cx - ring, cx + ring + 1):
+            for y in range(cy - ring, cy + ring + 1):
+                if abs(x - cx) == ring or abs(y - cy) == ring:
+                    for z in range(cz - ring, cz + ring + 1):
+                        yield (x, y, z)
+                else:
+                    yield (x, y, cz - ring)
+                    yield (x, y, cz + ring)
+
+    def stats(self):
+        return {
+            'objects': len(self.entries),
+            'cells': len(self.cells),
+            'max_radius': self.max_radius,
+        }
@@ -0,0 +1,143 @@
+from collections import deque
+import time
+
+
+def nebula_work(params):
+    spine = params.get('num_arms', 2) * params.get('points_per_arm', 100)
+    if params.get('gpu'):
+        return spine  # the particles are made by the shader
+    return spine * params.get('num_particles', 10)
+
+
+# How much work an object is relative to others of its kind. Costs are learned per
+# unit of work, so one estimate covers a 2 arm and a 5 arm nebula alike.
+WORK_UNITS = {
+    'nebula': nebula_work,
+}
+
+# Kinds that can be built a chunk of work at a time with build_step() / is_built()
+INCREMENTAL = {'nebula'}
+
+# Starting guesses in ms per unit of work, refined from measurements as objects get attached
+INITIAL_COSTS = {
+    'comet': 0.2,
+    'nebula': 0.00005,
+    'planet': 0.1,
+    'star': 0.1,
+}
+
+
+class SpawnScheduler:
+    """
+    Attaches finished spawn requests within a per-frame time budget.
+
+    Each frame run() takes requests off the GenerationPipeline while the estimated
+    cost of the next one still fits in budget_ms; whatever doesn't fit waits for the
+    next frame. The first request of a frame always goes through so a single object
+    that is bigger than the whole budget can't stall spawning forever.
+
+    Objects of an INCREMENTAL kind that wouldn't fit in a frame are spawned with
+    incremental=True instead, and their build_step() gets the leftover budget of
+    the following frames until they are complete. remaining_ms() is what's left of
+    the budget after run(), for other work that belongs in it (see StaticBatcher).
+    """
+
+    def __init__(self, budget_ms=4.0, smoothing=0.2, min_chunk=1000):
+        self.budget_ms = budget_ms
+        self.smoothing = smoothing
+        self.min_chunk = min_chunk
+        self.costs = dict(INITIAL_COSTS)
+        self.building = deque()
+        self.attached = 0
+        self.deferred_frames = 0
+        self.frame_start = time.perf_counter()
+        self.worked = False
+
+    def work(self, kind, params):
+        work_units = WORK_UNITS.get(kind)
+        return work_units(params) if work_units else 1
+
+    def estimate(self, kind, params):
+        return self.costs.get(kind, 1.0) * self.work(kind, params)
+
+    def record(self, kind, work, ms):
+        # Exponential moving average of the cost per unit of work
+        cost = ms / max(work, 1)
+        previous = self.costs.get(kind, cost)
+        self.costs[kind] = previous + self.smoothing * (cost - previous)
+
+    def run(self, pipeline, attach):
+        """
+        attach(kind, params, tag) does the actual spawning on the main thread and
+        returns the object. Returns the number of requests attached this frame.
+        """
+        start = self.frame_start = time.perf_counter()
+        worked = False
+
+        # Objects that are part way through being built come first
+        while self.building:
+            kind, obj = self.building[0]
+            spent = (time.perf_counter() - start) * 1000
+            if worked and spent >= self.budget_ms:
+                break
+            chunk = max(int((self.budget_ms - spent) / self.costs[kind]), self.min_chunk)
+            step_start = time.perf_counter()
+            work = obj.build_step(chunk)
+            self.record(kind, work, (time.perf_counter() - step_start) * 1000)
+            worked = True
+            if not obj.is_built():
+                break
+            self.building.popleft()
+
+        attached = 0
+        while True:
+            request = pipeline.peek()
+            if request is None:
+                break
+
+            spent = (time.perf_counter() - start) * 1000
+            estimate = self.estimate(request.kind, request.params)
+            if worked and spent + estimate > self.budget_ms:
+                self.deferred_frames += 1
+                break
+
+            kind, params, tag = pipeline.take()
+            incremental = kind in INCREMENTAL and estimate > self.budget_ms
+            if incremental:
+                params = dict(params, incremental=True)
+
+            attach_start = time.perf_counter()
+            obj = attach(kind, params, tag)
+            if incremental:
+                self.building.append((kind, obj))
+            else:
+                self.record(kind, self.work(kind, params), (time.perf_counter() - attach_start) * 1000)
+            attached += 1
+            worked = True
+
+        self.attached += attached
+        self.worked = worked
+        return attached
+
+    def remaining_ms(self):
+        """
+        Budget left this frame, or None if run() did nothing this frame, in which case
+        the next job can go ahead whatever its size, like run()'s first one does.
+        """
+        if not self.worked:
+            return None
+        return self.budget_ms - (time.perf_counter() - self.frame_start) * 1000
+
+    def forget(self, obj):
+        """
+        Stops building an object that got despawned before it was complete.
+        """
+        self.building = deque(entry for entry in self.building if entry[1] is not obj)
+
+    def stats(self):
+        return {
+            'attached': self.attached,
+            'deferred_frames': self.deferred_frames,
+            'building': len(self.building),
+            'costs_ms': dict(self.costs),
+        }
@@ -0,0 +1,81 @@
+import numpy as np
+
+from packed_arrays import PackedArrays
+
+
+class StarAnimator:
+    """
+    Pulses the lights of every star in one numpy pass per frame, instead of a task
+    per star.
+
+    Phase, pulse speed, base light color and position of each star live in
+    PackedArrays, one row per star.
+    Brightness only depends on the time, so stars can skip frames and still be right
+    when they're next updated. With a LightManager, only the stars whose light is
+    enabled are updated at all, since the others don't light anything; those out of
+    view are only updated every offscreen_every frames.
+    """
+
+    def __init__(self, lights=None, offscreen_every=4):
+        self.lights = lights
+        self.offscreen_every = offscreen_every
+        self.stars = PackedArrays(phases=np.zeros(0), speeds=np.zeros(0),
+                                  colors=np.zeros((0, 3)), positions=np.zeros((0, 3)))
+        self.light_owners = {}  # light NodePath -> star
+        self.frame = 0
+        self.animated = 0
+
+    def add(self, star):
+        self.light_owners[star.light_node] = star
+        color = star.light_node.node().getColor()
+        self.stars.add(star, phases=star.phase, speeds=star.pulse_speed,
+                       colors=(color[0], color[1], color[2]), positions=star.position)
+
+    def remove(self, star):
+        """
+        Stops animating the star, with its light back at full brightness.
+        """
+        del self.light_owners[star.light_node]
+        r, g, b = self.stars.colors[self.stars.slots[star]].tolist()
+        star.light_node.node().setColor((r, g, b, 1))
+        self.stars.remove(star)
+
+    def update(self, time, camera=None, lens=None, root=None):
+        """
+        Sets the light of the stars worth updating this frame to their brightness at
+        time. camera and lens (and root, the space star positions are in) enable the view test.
+        """
+        self.frame += 1
+        stars = self.stars
+        if self.lights is None:
+            slots = np.arange(len(stars))
+        else:
+            slots = np.array([stars.slots[self.light_owners[light_np]] for light_np in self.lights.active
+                              if light_np in self.light_owners], dtype=np.int64)
+        if camera is not None and len(slots) and self.frame % self.offscreen_every:
+            slots = slots[self.in_view(slots, camera, lens, root)]
+        self.animated = len(slots)
+        if not len(slots):
+            return
+
+        brightness = (np.sin(time * stars.speeds[slots] + stars.phases[slots]) + 1) / 2
+        colors = stars.colors[slots] * brightness[:, None]
+        for slot, (r, g, b) in zip(slots.tolist(), colors.tolist()):
+            stars.items[slot].light_node.node().setColor((r, g, b, 1))
+
+    def in_view(self, slots, camera, lens, root):
+        # Camera space is y forward, so a point is in view when it's in front and
+        # within the lens' field of view either way
+        mat = np.array(root.getMat(camera), dtype=np.float64).reshape(4, 4)
+        points = self.stars.positions[slots] @ mat[:3, :3] + mat[3, :3]
+        hfov, vfov = lens.getFov()
+        x_slope = np.tan(np.radians(hfov / 2))
+        z_slope = np.tan(np.radians(vfov / 2))
+        y = points[:, 1]
+        return (y > 0) & (np.abs(points[:, 0]) <= y * x_slope) & (np.abs(points[:, 2]) <= y * z_slope)
+
+    def stats(self):
+        return {
+            'stars': len(self.stars),
+            'animated': self.animated,
+        }
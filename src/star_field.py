@@ -0,0 +1,122 @@
+from panda3d.core import NodePath, GeomNode, Geom, GeomVertexData, GeomPoints, RenderModeAttrib
+import numpy as np
+
+from mesh import fill_vertex_data, pack_colors, vertex_format
+from sector_streaming import sector_of
+from seeding import object_seed
+
+
+# Tints stars get picked from, scaled by a random brightness
+STAR_TINTS = np.array([
+    [1.0, 1.0, 1.0],    # white
+    [0.8, 0.85, 1.0],   # blue-white
+    [1.0, 0.95, 0.8],   # yellow
+    [1.0, 0.8, 0.6],    # orange
+])
+
+
+def cell_stars(seeds, key, cell_size, stars_per_cell):
+    """
+    Positions and packed colors of the background stars in one cell, same every
+    time for the same SeedContext and cell.
+    """
+    rng = seeds.stream('stars', *key)
+    positions = (np.asarray(key) + rng.random((stars_per_cell, 3))) * cell_size
+
+    colors = np.ones((stars_per_cell, 4))
+    brightness = rng.uniform(0.3, 1.0, stars_per_cell) ** 2  # mostly dim, a few bright ones
+    colors[:, :3] = STAR_TINTS[rng.integers(len(STAR_TINTS), size=stars_per_cell)] * brightness[:, None]
+    return positions.astype(np.float32), pack_colors(colors)
+
+
+class StarField:
+    """
+    The background sky: every small star in the cells around the camera drawn as
+    one point Geom, so it costs a single draw call however many stars there are.
+
+    The vertex data is only rewritten when the camera moves into a new cell. The
+    `promote` stars nearest to the camera also get a full Star through
+    promote_star(pos, seed) / demote_star(star), so close ones look and light like
+    the real thing.
+    """
+
+    def __init__(self, seeds, promote_star, demote_star, cell_size=2000.0, radius=1,
+                 stars_per_cell=4000, promote=8, point_size=2, refresh_distance=50.0):
+        self.seeds = seeds
+        self.promote_star = promote_star
+        self.demote_star = demote_star
+        self.cell_size = cell_size
+        self.radius = radius
+        self.stars_per_cell = stars_per_cell
+        self.promote = promote
+        self.refresh_distance = refresh_distance
+
+        self.cells = {}
+        self.center = None
+        self.positions = np.zeros((0, 3), dtype=np.float32)
+        self.cell_order = []
+        self.promoted = {}
+        self.last_refresh = None
+
+        format = vertex_format('cloud')
+        geom = Geom(GeomVertexData('star_field', format, Geom.UHStatic))
+        geom.addPrimitive(GeomPoints(Geom.UHStatic))
+        node = GeomNode('star_field')
+        node.addGeom(geom)
+
+        self.node = NodePath(node)
+        self.node.setRenderMode(RenderModeAttrib.MPoint, point_size)
+        self.node.setLightOff()  # stars are their own light source
+
+    def update(self, pos):
+        center = sector_of(pos, self.cell_size)
+        if center != self.center:
+            self.center = center
+            self.load_cells(center)
+            self.last_refresh = None
+
+        pos = np.asarray(pos, dtype=np.float32)
+        if self.last_refresh is None or np.linalg.norm(pos - self.last_refresh) > self.refresh_distance:
+            self.last_refresh = pos
+            self.refresh_promoted(pos)
+
+    def load_cells(self, center):
+        r = self.radius
+        wanted = [(center[0] + dx, center[1] + dy, center[2] + dz)
+                  for dx in range(-r, r + 1) for dy in range(-r, r + 1) for dz in range(-r, r + 1)]
+        self.cells = {key: self.cells.get(key) or cell_stars(self.seeds, key, self.cell_size, self.stars_per_cell)
+                      for key in wanted}
+
+        self.positions = np.concatenate([self.cells[key][0] for key in wanted])
+        colors = np.concatenate([self.cells[key][1] for key in wanted])
+        self.cell_order = wanted
+
+        geom = self.node.node().modifyGeom(0)
+        fill_vertex_data(geom.modifyVertexData(), {'vertex': self.positions, 'color': colors})
+        points = geom.modifyPrimitive(0)
+        points.clearVertices()
+        points.addNextVertices(len(self.positions))
+        points.closePrimitive()
+
+    def refresh_promoted(self, pos):
+        count = min(self.promote, len(self.positions))
+        if count:
+            distances = np.einsum('ij,ij->i', self.positions - pos, self.positions - pos)
+            nearest = np.argpartition(distances, count - 1)[:count]
+        else:
+            nearest = []
+        # (cell, index in cell) stays the same while the star is in range, unlike the index in positions
+        wanted = {(self.cell_order[i // self.stars_per_cell], i % self.stars_per_cell): i for i in nearest}
+
+        for star_id in [star_id for star_id in self.promoted if star_id not in wanted]:
+            self.demote_star(self.promoted.pop(star_id))
+        for star_id, i in wanted.items():
+            if star_id not in self.promoted:
+                seed = object_seed(self.seeds.stream('promoted', *star_id[0], star_id[1]))
+                self.promoted[star_id] = self.promote_star(tuple(float(c) for c in self.positions[i]), seed)
+
+    def stats(self):
+        return {
+            'stars': len(self.positions),
+            'promoted': len(self.promoted),
+        }
@@ -0,0 +1,180 @@
+import time
+
+from panda3d.core import NodePath, Geom
+
+from eviction import geometry_size
+
+
+# Starting guess in ms per vertex, refined from measured rebuilds
+INITIAL_REBUILD_COST = 0.00004
+
+
+class SectorBatch:
+
+    def __init__(self, sector):
+        self.sector = sector
+        self.members = []
+        self.batched = []  # members whose geometry is copied into node
+        self.node = None
+        self.dirty = True
+
+
+class StaticBatcher:
+    """
+    Flattens the geometry that never changes (nebula clouds, planet rings) of every
+    sector into a few combined Geoms, one per render state, so drawing and culling
+    a sector costs about the same however many objects it holds.
+
+    Objects opt in with a static_geometry() method returning the NodePaths to batch.
+    Those are copied into the sector's batch and hidden on the object itself. Taking
+    an object out drops the batch until it's rebuilt, with the rest shown again. Objects that are still building
+    (see Nebula.is_built) draw themselves until they are done.
+
+    A batch is only rebuilt when its members change, at most max_rebuilds per update()
+    and only if the estimated cost fits in the budget it's given (see SpawnScheduler).
+    suspend(obj) takes an object out of its batch for a while (see ImpostorManager)
+    and resume(obj) puts it back.
+
+    The copies are a second set of vertex data next to the objects' own, which the
+    Evictor counts for every object is_batched() says is in a batch.
+    """
+
+    def __init__(self, max_rebuilds=1, smoothing=0.2):
+        self.max_rebuilds = max_rebuilds
+        self.smoothing = smoothing
+        self.cost = INITIAL_REBUILD_COST
+        self.batches = {}
+        self.object_batches = {}
+        self.building = []
+        self.suspended = {}  # obj -> sector
+        self.rebuilds = 0
+
+    def add(self, sector, obj):
+        batch = self.batches.get(sector)
+        if batch is None:
+            batch = self.batches[sector] = SectorBatch(sector)
+        self.object_batches[obj] = batch
+        if hasattr(obj, 'is_built') and not obj.is_built():
+            self.building.append(obj)
+        else:
+            batch.members.append(obj)
+            batch.dirty = True
+
+    def remove(self, obj):
+        self.suspended.pop(obj, None)
+        batch = self.object_batches.pop(obj, None)
+        if batch is None:
+            return
+        if obj in self.building:
+            self.building.remove(obj)
+        else:
+            batch.members.remove(obj)
+            batch.dirty = True
+            for geom_np in obj.static_geometry():
+                geom_np.show()
+            self.unbatch(batch)
+
+        if not batch.members and not any(self.object_batches.get(o) is batch for o in self.building):
+            del self.batches[batch.sector]
+
+    def unbatch(self, batch):
+        # The flattened copy still has whatever was taken out of it, so it goes right
+        # away, whatever the budget, and the members draw themselves until the rebuild
+        if batch.node is None:
+            return
+        batch.node.removeNode()
+        batch.node = None
+        for obj in batch.members:
+            for geom_np in obj.static_geometry():
+                geom_np.show()
+        batch.batched = []
+
+    def suspend(self, obj):
+        batch = self.object_batches.get(obj)
+        if batch is not None:
+            sector = batch.sector
+            self.remove(obj)
+            self.suspended[obj] = sector
+
+    def resume(self, obj):
+        sector = self.suspended.pop(obj, None)
+        if sector is not None:
+            self.add(sector, obj)
+
+    def is_batched(self, obj):
+        batch = self.object_batches.get(obj)
+        return batch is not None and obj in batch.batched
+
+    def update(self, budget_ms=None):
+        """
+        Rebuilds up to max_rebuilds dirty batches, only those whose estimated cost still
+        fits in budget_ms if there is one.
+        """
+        start = time.perf_counter()
+        for obj in [obj for obj in self.building if obj.is_built()]:
+            self.building.remove(obj)
+            batch = self.object_batches[obj]
+            batch.members.append(obj)
+            batch.dirty = True
+
+        rebuilt = 0
+        for batch in self.batches.values():
+            if rebuilt == self.max_rebuilds:
+                break
+            if not batch.dirty:
+                continue
+            if budget_ms is not None:
+                spent = (time.perf_counter() - start) * 1000
+                if spent + self.cost * self.num_vertices(batch) > budget_ms:
+                    continue
+            self.rebuild(batch)
+            rebuilt += 1
+
+    def num_vertices(self, batch):
+        return sum(geometry_size(geom_np)[0] for obj in batch.members for geom_np in obj.static_geometry())
+
+    def rebuild(self, batch):
+        start = time.perf_counter()
+        if batch.node is not None:
+            batch.node.removeNode()
+
+        root = NodePath('static_batch')
+        for obj in batch.members:
+            for geom_np in obj.static_geometry():
+                copy = geom_np.copyTo(root)
+                copy.setTransform(geom_np.getTransform(batch.sector.node))
+                copy.show()
+                geom_np.hide()
+
+        # Everything with the same state ends up in one Geom, with the transforms baked in
+        root.flattenStrong()
+        for geom_np in root.findAllMatches('**/+GeomNode'):
+            geom_node = geom_np.node()
+            for i in range(geom_node.getNumGeoms()):
+                geom = geom_node.modifyGeom(i)
+                geom.setUsageHint(Geom.UHStatic)
+                geom.modifyVertexData().setUsageHint(Geom.UHStatic)
+
+        root.reparentTo(batch.sector.node)
+        batch.node = root
+        batch.batched = list(batch.members)
+        batch.dirty = False
+        self.rebuilds += 1
+
+        # Exponential moving average of the cost per vertex, like SpawnScheduler's
+        num_vertices = geometry_size(root)[0]
+        if num_vertices:
+            cost = (time.perf_counter() - start) * 1000 / num_vertices
+            self.cost += self.smoothing * (cost - self.cost)
+
+    def stats(self):
+        geoms = 0
+        for batch in self.batches.values():
+            if batch.node is not None:
+                geoms += sum(geom_np.node().getNumGeoms() for geom_np in batch.node.findAllMatches('**/+GeomNode'))
+        return {
+            'batches': len(self.batches),
+            'members': sum(len(batch.members) for batch in self.batches.values()),
+            'geoms': geoms,
+            'rebuilds': self.rebuilds,
+        }
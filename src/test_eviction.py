@@ -0,0 +1,26 @@
+from panda3d.core import Camera, NodePath, PerspectiveLens
+
+from eviction import Evictor
+from Nebula import Nebula
+from Star import Star
+
+
+def test_object_in_front_of_camera_is_visible_at_its_distance():
+    render = NodePath('render')
+    lens = PerspectiveLens()
+    lens.setFar(5000)
+    camera = render.attachNewNode(Camera('camera', lens))
+    camera.setPos(100, -200, 50)  # off the origin, where a doubled transform shows
+
+    evictor = Evictor(max_hidden_time=1)
+    objects = [Star(radius=1.0, pos=(100, 300, 50), seed=1),
+               Nebula(scale=1.0, pos=(100, 300, 50), seed=2)]
+    for obj in objects:
+        obj.node.reparentTo(render)
+        evictor.track(obj, 0.0)
+
+    assert evictor.update(camera, lens, 10.0) == []
+    for obj in objects:
+        entry = evictor.tracked[obj]
+        assert entry.last_visible == 10.0
+        assert abs(entry.distance - 500) < 50